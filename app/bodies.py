@@ -0,0 +1,86 @@
+"""Corpos grandes guardados por referência
+
+Com BODY_OFFLOAD_MIN > 0, a API grava cada corpo de pelo menos esse tamanho
+uma única vez na tabela `corpos`, endereçado pelo SHA-256 do conteúdo (a
+mesma newsletter para 100 mil destinatários vira uma linha só). A linha em
+`emails` e a entrada da fila levam só o hash (`corpo`), e o worker busca o
+conteúdo no Postgres mantendo um cache LRU limitado por bytes.
+"""
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from psycopg2.extras import execute_values
+
+
+logger = logging.getLogger(__name__)
+
+# Tamanho (caracteres) a partir do qual o corpo sai da fila; 0 desliga
+BODY_OFFLOAD_MIN = int(os.getenv('BODY_OFFLOAD_MIN', 0))
+BODY_CACHE_BYTES = int(os.getenv('BODY_CACHE_BYTES', 64 * 1024 * 1024))
+
+STORE_SQL = 'INSERT INTO corpos (hash, conteudo) VALUES %s ON CONFLICT (hash) DO NOTHING'
+
+
+class BodyNotFound(Exception):
+    """O hash da mensagem não existe na tabela corpos"""
+
+
+def body_hash(mensagem):
+    return hashlib.sha256(mensagem.encode()).hexdigest()
+
+
+def should_offload(mensagem):
+    return bool(BODY_OFFLOAD_MIN) and mensagem is not None and len(mensagem) >= BODY_OFFLOAD_MIN
+
+
+def store_bodies(cur, bodies):
+    """Grava {hash: conteúdo} ignorando os que já existem (na transação de `cur`)"""
+    if bodies:
+        execute_values(cur, STORE_SQL, list(bodies.items()))
+
+
+class BodyCache:
+    """Corpos por hash, descartando os menos usados além de `max_bytes`"""
+
+    def __init__(self, pool, max_bytes=BODY_CACHE_BYTES):
+        self.pool = pool
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, digest):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('SELECT conteudo FROM corpos WHERE hash = %s', (digest,))
+                row = cur.fetchone()
+            conn.rollback()
+        if row is None:
+            raise BodyNotFound(f"Corpo {digest} não existe")
+        return row[0]
+
+    def get(self, digest):
+        with self._lock:
+            conteudo = self._cache.get(digest)
+            if conteudo is not None:
+                self._cache.move_to_end(digest)
+                self.hits += 1
+                return conteudo
+            self.misses += 1
+        conteudo = self.load(digest)
+        with self._lock:
+            if digest not in self._cache and len(conteudo) <= self.max_bytes:
+                self._cache[digest] = conteudo
+                self.bytes += len(conteudo)
+                while self.bytes > self.max_bytes:
+                    _, removido = self._cache.popitem(last=False)
+                    self.bytes -= len(removido)
+        return conteudo
+
+    def info(self):
+        return {'size': len(self._cache), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses}
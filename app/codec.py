@@ -0,0 +1,81 @@
+"""Codificação das entradas da fila
+
+O primeiro byte identifica o formato, então os workers decodificam qualquer
+entrada independentemente do QUEUE_CODEC de quem a produziu:
+
+- `{`: JSON, o formato original (sem tag), sempre aceito
+- `\\x01`: msgpack (versão 1)
+- `\\x02`: msgpack comprimido com zstd, usado quando a entrada passa de
+  QUEUE_COMPRESS_MIN bytes
+
+Para migrar, atualize primeiro os workers e depois troque QUEUE_CODEC nos
+produtores (API, relay do outbox). msgpack e zstandard são opcionais: sem
+zstandard as entradas grandes só não são comprimidas.
+"""
+import os
+import json
+import threading
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - dependência opcional
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - dependência opcional
+    zstandard = None
+
+TAG_MSGPACK = b'\x01'
+TAG_MSGPACK_ZSTD = b'\x02'
+
+QUEUE_CODEC = os.getenv('QUEUE_CODEC', 'json').lower()
+# Tamanho (bytes) a partir do qual a entrada em msgpack é comprimida; 0 desliga
+QUEUE_COMPRESS_MIN = int(os.getenv('QUEUE_COMPRESS_MIN', 1024))
+QUEUE_COMPRESS_LEVEL = int(os.getenv('QUEUE_COMPRESS_LEVEL', 3))
+
+if QUEUE_CODEC not in ('json', 'msgpack'):
+    raise ValueError(f"QUEUE_CODEC inválido: {QUEUE_CODEC!r} (use json ou msgpack)")
+if QUEUE_CODEC == 'msgpack' and msgpack is None:
+    raise RuntimeError("QUEUE_CODEC=msgpack exige o pacote msgpack")
+
+# Os (de)compressores do zstd não podem ser usados por duas threads ao mesmo tempo
+_local = threading.local()
+
+
+def _compressor():
+    if not hasattr(_local, 'compressor'):
+        _local.compressor = zstandard.ZstdCompressor(level=QUEUE_COMPRESS_LEVEL)
+    return _local.compressor
+
+
+def _decompressor():
+    if not hasattr(_local, 'decompressor'):
+        _local.decompressor = zstandard.ZstdDecompressor()
+    return _local.decompressor
+
+
+def encode(mensagem, codec=QUEUE_CODEC):
+    """Serializa a mensagem (dict) no formato do codec"""
+    if codec == 'json':
+        return json.dumps(mensagem)
+    packed = msgpack.packb(mensagem, use_bin_type=True)
+    if zstandard is not None and QUEUE_COMPRESS_MIN and len(packed) >= QUEUE_COMPRESS_MIN:
+        return TAG_MSGPACK_ZSTD + _compressor().compress(packed)
+    return TAG_MSGPACK + packed
+
+
+def decode(raw):
+    """Lê uma entrada em qualquer formato; levanta ValueError se for inválida"""
+    if isinstance(raw, str):
+        raw = raw.encode()
+    tag = raw[:1]
+    try:
+        if tag == TAG_MSGPACK:
+            return msgpack.unpackb(raw[1:], raw=False)
+        if tag == TAG_MSGPACK_ZSTD:
+            return msgpack.unpackb(_decompressor().decompress(raw[1:]), raw=False)
+    except Exception as e:
+        # msgpack/zstd ausentes ou entrada corrompida
+        raise ValueError(f"Entrada {tag!r} inválida: {e}")
+    return json.loads(raw)
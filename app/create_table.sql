@@ -8,4 +8,67 @@ CREATE TABLE IF NOT EXISTS emails (
 );
 
 -- Create index on data for better performance
-CREATE INDEX IF NOT EXISTS idx_emails_data ON emails(data); 
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_emails_data ON emails(data);
+
+-- Outbox: pendente = aguardando o relay, enfileirada = já está na fila do Redis
+-- (linhas antigas ficam como enfileirada para não serem reenviadas)
+ALTER TABLE emails ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'enfileirada';
+CREATE INDEX IF NOT EXISTS idx_emails_pendentes ON emails(id) WHERE status = 'pendente';
+
+-- Resultado do envio gravado pelo worker (enviada, reagendada ou falhou)
+ALTER TABLE emails ADD COLUMN IF NOT EXISTS tentativas INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE emails ADD COLUMN IF NOT EXISTS provedor_id VARCHAR(100);
+ALTER TABLE emails ADD COLUMN IF NOT EXISTS enviado_em TIMESTAMP;
+ALTER TABLE emails ADD COLUMN IF NOT EXISTS erro TEXT;
+-- O id no fim dos índices atende a paginação por keyset em (data, id)
+CREATE INDEX IF NOT EXISTS idx_emails_email_data ON emails(email, data, id);
+CREATE INDEX IF NOT EXISTS idx_emails_status_data ON emails(status, data, id);
+
+-- Tabelas criadas pelo scripts/init.sql antigo não tinham chave primária
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conrelid = 'emails'::regclass AND contype = 'p') THEN
+        ALTER TABLE emails ADD PRIMARY KEY (id);
+    END IF;
+END
+$$;
+
+-- Templates: o corpo fica guardado uma vez e as mensagens levam só o id e as variáveis
+CREATE TABLE IF NOT EXISTS templates (
+    id SERIAL PRIMARY KEY,
+    nome VARCHAR(100) NOT NULL,
+    assunto VARCHAR(255) NOT NULL,
+    corpo TEXT NOT NULL,
+    criado_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+ALTER TABLE emails ADD COLUMN IF NOT EXISTS template_id INTEGER REFERENCES templates(id);
+ALTER TABLE emails ADD COLUMN IF NOT EXISTS variaveis JSONB;
+ALTER TABLE emails ALTER COLUMN assunto DROP NOT NULL;
+ALTER TABLE emails ALTER COLUMN mensagem DROP NOT NULL;
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'emails_conteudo_check') THEN
+        ALTER TABLE emails ADD CONSTRAINT emails_conteudo_check
+            CHECK (template_id IS NOT NULL OR (assunto IS NOT NULL AND mensagem IS NOT NULL));
+    END IF;
+END
+$$;
+
+-- Corpos grandes guardados uma vez por hash (BODY_OFFLOAD_MIN); a fila leva só a referência
+CREATE TABLE IF NOT EXISTS corpos (
+    hash CHAR(64) PRIMARY KEY,
+    conteudo TEXT NOT NULL,
+    criado_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+ALTER TABLE emails ADD COLUMN IF NOT EXISTS corpo_hash CHAR(64) REFERENCES corpos(hash);
+ALTER TABLE emails ALTER COLUMN mensagem TYPE TEXT;
+ALTER TABLE emails DROP CONSTRAINT IF EXISTS emails_conteudo_check;
+ALTER TABLE emails ADD CONSTRAINT emails_conteudo_check
+    CHECK (template_id IS NOT NULL OR (assunto IS NOT NULL AND (mensagem IS NOT NULL OR corpo_hash IS NOT NULL)));
+
+-- Prioridade (fila do Redis) da mensagem: alta, normal ou baixa
+ALTER TABLE emails ADD COLUMN IF NOT EXISTS prioridade VARCHAR(10) NOT NULL DEFAULT 'normal';
+
+-- Envio agendado: status agendada até agendado_para (UTC)
+ALTER TABLE emails ADD COLUMN IF NOT EXISTS agendado_para TIMESTAMP;
@@ -0,0 +1,278 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+
+def dsn_from_env(host=None):
+    """DSN a partir das variáveis DB_*; `host` troca o DB_HOST (ex.: réplica de leitura)"""
+    return f"dbname={os.getenv('DB_NAME', 'email_sender')} " \
+           f"user={os.getenv('DB_USER', 'postgres')} " \
+           f"password={os.getenv('DB_PASS', 'postgres')} " \
+           f"host={host or os.getenv('DB_HOST', 'db')}"
+
+
+class PoolTimeout(Exception):
+    """Nenhuma conexão ficou livre dentro do tempo de espera"""
+
+
+class PostgresPool:
+    """Pool de conexões PostgreSQL limitado e thread-safe
+
+    As conexões são abertas sob demanda até `maxconn`, reaproveitadas em
+    ordem LIFO (a mais quente primeiro) e recicladas quando ficam ociosas
+    por mais de `idle_timeout` segundos ou passam de `max_lifetime`.
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, idle_timeout=300,
+                 max_lifetime=3600, wait_timeout=5, check_after=30,
+                 connect_timeout=5):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Tamanho de pool inválido: min={minconn} max={maxconn}")
+
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.wait_timeout = wait_timeout
+        self.check_after = check_after
+        self.connect_timeout = connect_timeout
+
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._idle = []      # [(conn, criada_em, usada_em)], a mais recente no fim
+        self._created = {}   # id(conn) -> criada_em, para as conexões em uso
+        self._inherited = []  # conexões do processo pai, nunca fechadas aqui
+        self._total = 0      # conexões abertas ou sendo abertas
+        self._in_use = 0
+        self._waiting = 0
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._opened = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @classmethod
+    def from_env(cls, dsn):
+        """Cria o pool a partir das variáveis DB_POOL_*"""
+        return cls(
+            dsn,
+            minconn=int(os.getenv('DB_POOL_MIN', 1)),
+            maxconn=int(os.getenv('DB_POOL_MAX', 10)),
+            idle_timeout=float(os.getenv('DB_POOL_IDLE_TIMEOUT', 300)),
+            max_lifetime=float(os.getenv('DB_POOL_MAX_LIFETIME', 3600)),
+            wait_timeout=float(os.getenv('DB_POOL_WAIT_TIMEOUT', 5)),
+            check_after=float(os.getenv('DB_POOL_CHECK_AFTER', 30)),
+        )
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connect_timeout=self.connect_timeout)
+        with self._cond:
+            self._opened += 1
+        return conn
+
+    def _close(self, conn):
+        with self._cond:
+            self._discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, used_at, now):
+        """Checagem barata sempre; SELECT 1 só se a conexão ficou parada"""
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if now - used_at < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _prune_idle(self, now):
+        """Fecha conexões ociosas além do mínimo (chamado com o lock)"""
+        expired = []
+        while self._idle and self._total > self.minconn:
+            conn, created_at, used_at = self._idle[0]
+            if now - used_at < self.idle_timeout and now - created_at < self.max_lifetime:
+                break
+            self._idle.pop(0)
+            self._total -= 1
+            expired.append(conn)
+        return expired
+
+    def warm(self):
+        """Abre `minconn` conexões antecipadamente"""
+        while True:
+            with self._cond:
+                if self._total >= self.minconn:
+                    return
+                self._total += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._total -= 1
+                    self._cond.notify()
+                raise
+            now = time.monotonic()
+            with self._cond:
+                self._idle.append((conn, now, now))
+                self._cond.notify()
+
+    def _after_fork(self):
+        """Esquece as conexões herdadas do processo pai sem fechá-las
+
+        Fechar enviaria o Terminate pelo socket que o pai ainda usa, e o
+        psycopg2 fecha a conexão quando ela é coletada: por isso as ociosas
+        continuam referenciadas em `_inherited`.
+        """
+        self._inherited.extend(conn for conn, _, _ in self._idle)
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._idle = []
+        self._created = {}
+        self._total = 0
+        self._in_use = 0
+        self._waiting = 0
+
+    def getconn(self):
+        """Retira uma conexão saudável do pool, esperando até `wait_timeout`"""
+        if self._pid != os.getpid():
+            self._after_fork()
+        started = time.monotonic()
+        deadline = started + self.wait_timeout
+
+        while True:
+            candidate = None
+            must_open = False
+            with self._cond:
+                expired = self._prune_idle(time.monotonic())
+                while not self._idle and self._total >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"Nenhuma conexão livre em {self.wait_timeout}s "
+                            f"(em uso: {self._in_use}/{self.maxconn})")
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                if self._idle:
+                    candidate = self._idle.pop()
+                else:
+                    self._total += 1
+                    must_open = True
+
+            for conn in expired:
+                self._close(conn)
+
+            now = time.monotonic()
+            if must_open:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+                created_at = now
+            else:
+                conn, created_at, used_at = candidate
+                if not self._is_healthy(conn, used_at, now):
+                    logger.warning("[POOL] Discarding broken connection")
+                    self._close(conn)
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    continue
+
+            waited = time.monotonic() - started
+            with self._cond:
+                self._in_use += 1
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+                self._created[id(conn)] = created_at
+            return conn
+
+    def putconn(self, conn, discard=False):
+        """Devolve a conexão; conexões quebradas ou velhas são fechadas"""
+        now = time.monotonic()
+        with self._cond:
+            created_at = self._created.pop(id(conn), now)
+            self._in_use -= 1
+
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        if discard or conn.closed or now - created_at >= self.max_lifetime:
+            self._close(conn)
+            with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            return
+
+        with self._cond:
+            self._idle.append((conn, created_at, now))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Empresta uma conexão; faz rollback e descarta em caso de erro de conexão"""
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def closeall(self):
+        """Fecha as conexões ociosas (as em uso são fechadas ao voltar)"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._total -= len(idle)
+        for conn, _, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        """Métricas de uso do pool"""
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                'min': self.minconn,
+                'max': self.maxconn,
+                'total': self._total,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'checkouts': checkouts,
+                'timeouts': self._timeouts,
+                'opened': self._opened,
+                'discarded': self._discarded,
+                'wait_avg_ms': round(self._wait_total / checkouts * 1000, 3) if checkouts else 0.0,
+                'wait_max_ms': round(self._wait_max * 1000, 3),
+            }
@@ -0,0 +1,367 @@
+"""Entrega de e-mails compartilhada pelo worker/worker.py e pelo WorkerThread"""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+from rate_limit import RateLimiter
+from retry import RetryScheduler
+from schedule import Scheduler
+from templates import TemplateError
+from bodies import BodyNotFound
+from codec import decode
+from logs import debug_sampled
+from metrics import REGISTRY
+from transports import open_transport
+
+logger = logging.getLogger(__name__)
+
+# Quantas chamadas ao provedor podem ficar pendentes ao mesmo tempo
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', 10))
+# A API de lote do Resend aceita no máximo 100 e-mails por chamada
+BATCH_SIZE = max(1, min(int(os.getenv('BATCH_SIZE', 100)), 100))
+# Tempo máximo (s) esperando mais mensagens para completar um lote
+BATCH_LINGER = float(os.getenv('BATCH_LINGER', 0.05))
+
+MESSAGES = REGISTRY.counter('worker_messages_total', 'Mensagens processadas pelo worker, por resultado', ('result',))
+SEND_LATENCY = REGISTRY.histogram('worker_send_duration_seconds',
+                                  'Duração das chamadas ao provedor (um lote por chamada, sem a espera do limite)')
+PROVIDER_ERRORS = REGISTRY.counter('worker_provider_errors_total', 'Erros do provedor, por código', ('code',))
+BATCHES_STARTED = REGISTRY.counter('worker_batches_started_total', 'Lotes entregues às threads de envio')
+BATCHES_FINISHED = REGISTRY.counter('worker_batches_finished_total', 'Lotes concluídos pelas threads de envio')
+REGISTRY.gauge('worker_batches_in_flight', 'Lotes em andamento nas threads de envio',
+               lambda: {(): BATCHES_STARTED.total() - BATCHES_FINISHED.total()})
+
+
+def error_code(error):
+    """Código do erro do provedor (status HTTP do Resend, código SMTP) ou o nome da exceção"""
+    return str(getattr(error, 'code', None) or type(error).__name__)
+
+
+def validate_message(mensagem):
+    """Valida se a mensagem contém todos os campos necessários"""
+    # Mensagens de template trazem o id dele no lugar do assunto e do corpo
+    if 'template' in mensagem:
+        required_fields = ['email', 'template']
+    elif 'corpo' in mensagem:
+        # Corpo guardado por referência: `corpo` é o hash na tabela corpos
+        required_fields = ['email', 'assunto', 'corpo']
+    else:
+        required_fields = ['email', 'assunto', 'mensagem']
+    missing_fields = [field for field in required_fields if field not in mensagem]
+
+    if missing_fields:
+        return False, f"Campos obrigatórios ausentes: {missing_fields}"
+
+    if not all(mensagem[field] for field in required_fields):
+        return False, "Campos obrigatórios não podem estar vazios"
+
+    return True, "Mensagem válida"
+
+
+def decode_message(mensagem_raw):
+    """Decodifica e valida uma entrada da fila (JSON ou msgpack); retorna (mensagem, erro)"""
+    try:
+        mensagem = decode(mensagem_raw)
+    except ValueError as e:
+        return None, f"Erro ao decodificar a mensagem: {e}"
+
+    if not isinstance(mensagem, dict):
+        return None, "Mensagem deve ser um objeto"
+
+    is_valid, validation_msg = validate_message(mensagem)
+    if not is_valid:
+        return None, f"Validação falhou: {validation_msg}"
+    return mensagem, None
+
+
+class Stats:
+    """Contadores do worker compartilhados entre as threads de envio"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.message_count = 0
+        self.error_count = 0
+
+    def message(self, n=1):
+        with self._lock:
+            self.message_count += n
+            return self.message_count
+
+    def error(self, n=1):
+        with self._lock:
+            self.error_count += n
+
+    def __str__(self):
+        return f"Mensagens processadas: {self.message_count}, Erros: {self.error_count}"
+
+
+class DeliveryEngine:
+    """Envia lotes pelo `transport` (transports.py) mantendo até `concurrency` chamadas em andamento
+
+    Quem consome a fila deve chamar `acquire()` antes de retirar um lote e
+    `submit()` (ou `release()`, se a fila estava vazia) depois. Assim o
+    processo nunca retira do Redis mais do que consegue enviar. As mensagens
+    só recebem `ack` na fila depois que o provedor aceitou o envio ou que a
+    nova tentativa foi agendada. Com um `status` (status.StatusWriter), o
+    resultado de cada mensagem é gravado na tabela `emails`. Mensagens com
+    `template` são renderizadas pelo `templates` (templates.TemplateCache) e
+    as com `corpo` buscam o conteúdo no `bodies` (bodies.BodyCache). Sem
+    `transport`, usa o configurado em EMAIL_TRANSPORT.
+    """
+
+    def __init__(self, queue, from_email, concurrency=WORKER_CONCURRENCY, stats=None, limiter=None,
+                 status=None, templates=None, bodies=None, transport=None):
+        self.queue = queue
+        self.transport = transport or open_transport()
+        REGISTRY.gauge('worker_transport_connections', 'Requisições e conexões do transporte (reaproveitadas ou abertas)',
+                       lambda: {(stat,): value for stat, value in self.transport.stats().items() if stat != 'transport'},
+                       ('stat',))
+        self.status = status
+        self.templates = templates
+        self.bodies = bodies
+        self.from_email = from_email
+        self.limiter = limiter or RateLimiter.from_env(queue.redis)
+        self.retry = RetryScheduler(queue.redis, queue.transport)
+        self.scheduled = Scheduler(queue.redis, queue.transport)
+        self.concurrency = concurrency
+        self.stats = stats or Stats()
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='envio')
+
+    def acquire(self, timeout=1):
+        return self._slots.acquire(timeout=timeout)
+
+    def release(self):
+        self._slots.release()
+
+    def submit(self, batch):
+        BATCHES_STARTED.inc()
+        future = self._executor.submit(self.deliver, batch)
+        future.add_done_callback(lambda done: self._finished(done, batch))
+        return future
+
+    def _finished(self, future, batch):
+        """Libera a vaga; se `deliver` falhou antes do envio, devolve o lote à fila"""
+        try:
+            error = future.exception()
+            if error is not None:
+                logger.error("❌ Erro inesperado ao processar lote de %d mensagem(ns): %s",
+                             len(batch), error, exc_info=error)
+                self.queue.nack(batch)
+        except redis.exceptions.RedisError as e:
+            # Fica em processamento: o reap (ou o close) devolve à fila
+            logger.error("❌ Erro ao devolver o lote à fila: %s", e)
+        finally:
+            BATCHES_FINISHED.inc()
+            self._slots.release()
+
+    def ack(self, ids):
+        """Confirma as entradas, com uma nova tentativa se o Redis falhar
+
+        Se falhar de novo, as entradas ficam em processamento e o reap (ou o
+        close) as devolve à fila, podendo ser enviadas mais uma vez.
+        """
+        if not ids:
+            return
+        try:
+            self.queue.ack(ids)
+        except redis.exceptions.RedisError as e:
+            logger.warning("⚠️ Erro ao confirmar %d mensagem(ns), tentando de novo: %s", len(ids), e)
+            time.sleep(0.5)
+            try:
+                self.queue.ack(ids)
+            except redis.exceptions.RedisError as e:
+                logger.error("❌ Erro ao confirmar %d mensagem(ns): %s", len(ids), e)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+        self.transport.close()
+
+    def build_email(self, mensagem):
+        if 'template' in mensagem:
+            if self.templates is None:
+                raise TemplateError("Worker sem acesso aos templates")
+            assunto, corpo = self.templates.render(mensagem)
+        elif 'corpo' in mensagem:
+            if self.bodies is None:
+                raise BodyNotFound("Worker sem acesso aos corpos guardados por referência")
+            assunto, corpo = mensagem['assunto'], self.bodies.get(mensagem['corpo'])
+        else:
+            assunto, corpo = mensagem['assunto'], mensagem['mensagem']
+        return {
+            "from": self.from_email,
+            "to": mensagem['email'],
+            "subject": assunto,
+            "html": corpo
+        }
+
+    def send_batch(self, emails):
+        """Envia os e-mails e retorna as respostas do provedor na mesma ordem
+
+        A resposta de um e-mail recusado sozinho (SMTP) é a exceção.
+        """
+        # Cada lote é uma chamada à API, mas conta len(emails) na cota diária
+        waited = self.limiter.acquire(self.from_email, emails=len(emails))
+        if waited:
+            logger.info("🚦 Aguardou %.2fs pelo limite de envio", waited)
+        started = time.perf_counter()
+        try:
+            return self.transport.send(emails)
+        except Exception as e:
+            PROVIDER_ERRORS.inc((error_code(e),))
+            raise
+        finally:
+            SEND_LATENCY.observe(time.perf_counter() - started)
+
+    def fail(self, mensagens, entries, error):
+        """Agenda nova tentativa (ou a fila de mortas) e confirma as entradas"""
+        self.stats.error(len(mensagens))
+        logger.info("📈 Estatísticas - %s", self.stats)
+        try:
+            retried, dead = self.retry.schedule(mensagens, error)
+        except redis.exceptions.RedisError as redis_error:
+            logger.error("❌ Erro ao agendar nova tentativa: %s", redis_error)
+            try:
+                self.queue.nack(entries)
+            except redis.exceptions.RedisError as e:
+                logger.error("❌ Erro ao devolver %d mensagem(ns) à fila: %s", len(entries), e)
+            return
+        self.ack([entry_id for entry_id, _ in entries])
+        logger.info("🔁 Reagendadas: %d, enviadas para a fila de mortas: %d", len(retried), len(dead))
+        MESSAGES.inc(('retried',), len(retried))
+        MESSAGES.inc(('dead',), len(dead))
+        if self.status:
+            self.status.failed(retried, error, retrying=True)
+            self.status.failed(dead, error, retrying=False)
+
+    def deliver(self, batch):
+        """Decodifica o lote, descarta as inválidas e envia o restante
+
+        `batch` é a lista de (id, mensagem_raw) retornada por `queue.fetch()`.
+        Retorna a lista de (mensagem, resposta do provedor) enviadas.
+        """
+        self.stats.message(len(batch))
+        mensagens = []
+        emails = []
+        entries = []
+        invalid_ids = []
+        failed = []
+        failed_entries = []
+        failure = None
+        for entry_id, mensagem_raw in batch:
+            mensagem, erro = decode_message(mensagem_raw)
+            if not erro:
+                try:
+                    email = self.build_email(mensagem)
+                except (TemplateError, BodyNotFound) as e:
+                    erro = str(e)
+                    if self.status:
+                        tentativas = int(mensagem.get('tentativas', 0)) + 1
+                        self.status.failed([dict(mensagem, tentativas=tentativas)], e, retrying=False)
+                except Exception as e:
+                    # Banco fora do ar ao buscar o template ou o corpo: tenta de novo mais tarde
+                    failed.append(mensagem)
+                    failed_entries.append((entry_id, mensagem_raw))
+                    failure = e
+                    continue
+            if erro:
+                self.stats.error()
+                logger.error("❌ %s", erro)
+                logger.error("📋 Conteúdo da mensagem: %r", mensagem_raw[:200])
+                invalid_ids.append(entry_id)
+                continue
+            mensagens.append(mensagem)
+            emails.append(email)
+            entries.append((entry_id, mensagem_raw))
+
+        # Mensagens inválidas nunca serão enviadas: descarta da fila
+        self.ack(invalid_ids)
+        if invalid_ids:
+            MESSAGES.inc(('invalid',), len(invalid_ids))
+        if failed:
+            logger.error("❌ Erro ao montar %d email(s): %s", len(failed), failure)
+            self.fail(failed, failed_entries, failure)
+        if not mensagens:
+            return []
+
+        logger.info("📧 Enviando lote de %d email(s)", len(mensagens))
+        started = time.monotonic()
+        try:
+            results = self.send_batch(emails)
+        except Exception as e:
+            logger.error("❌ Erro ao enviar lote de %d email(s): %s", len(mensagens), e)
+            self.fail(mensagens, entries, e)
+            return []
+
+        if any(isinstance(result, Exception) for result in results):
+            # O SMTP recusa mensagens uma a uma: só as recusadas vão para nova tentativa
+            accepted = []
+            for mensagem, entry, result in zip(mensagens, entries, results):
+                if isinstance(result, Exception):
+                    logger.error("❌ Envio para %s recusado: %s", mensagem['email'], result)
+                    PROVIDER_ERRORS.inc((error_code(result),))
+                    self.fail([mensagem], [entry], result)
+                else:
+                    accepted.append((mensagem, entry, result))
+            if not accepted:
+                return []
+            mensagens, entries, results = (list(column) for column in zip(*accepted))
+
+        self.ack([entry_id for entry_id, _ in entries])
+        # Já enviado: um erro daqui em diante não pode devolver o lote à fila
+        try:
+            MESSAGES.inc(('sent',), len(mensagens))
+            if self.status:
+                self.status.sent(mensagens, results)
+            # Um log por mensagem não cabe no caminho quente: só uma amostra, em DEBUG
+            for mensagem, result in zip(mensagens, results):
+                debug_sampled(logger, "✅ Email enviado para %s - Resposta do provedor: %s", mensagem['email'], result)
+            logger.info("📊 Lote de %d enviado em %.3fs - %s", len(mensagens), time.monotonic() - started, self.stats)
+        except Exception as e:
+            logger.error("❌ Erro ao registrar o lote enviado: %s", e)
+        return list(zip(mensagens, results))
+
+
+def run_consumer(queue, engine, running):
+    """Laço de consumo usado pelo worker e pelo WorkerThread
+
+    Roda enquanto `running()` for verdadeiro; ao sair espera os envios em
+    andamento e devolve à fila o que não foi confirmado.
+    """
+    while running():
+        # Só retira um lote da fila quando há uma vaga para enviá-lo
+        if not engine.acquire(timeout=1):
+            try:
+                queue.heartbeat()
+            except redis.exceptions.RedisError as e:
+                logger.error("❌ Erro ao renovar heartbeat: %s", e)
+            continue
+        try:
+            queue.reap()
+            engine.retry.promote()
+            engine.scheduled.promote()
+            batch = queue.fetch(BATCH_SIZE, linger=BATCH_LINGER, timeout=5)
+            if not batch:
+                engine.release()
+                logger.info("⏰ Timeout - Nenhuma mensagem na fila nos últimos 5 segundos")
+                continue
+
+            logger.debug("📨 Lote de %d mensagem(ns) capturado do Redis", len(batch))
+            engine.submit(batch)
+
+        except redis.exceptions.TimeoutError:
+            engine.release()
+            logger.info("⏰ Timeout - Nenhuma mensagem na fila nos últimos 5 segundos")
+            continue
+        except Exception as e:
+            engine.release()
+            engine.stats.error()
+            logger.error("❌ Erro ao ler a fila: %s", e)
+            logger.info("📈 Estatísticas - %s", engine.stats)
+            time.sleep(2)  # Espera antes de tentar novamente
+
+    engine.shutdown()
+    queue.close()
@@ -0,0 +1,95 @@
+"""Configuração do gunicorn para rodar o Sender em produção
+
+    gunicorn -c gunicorn.conf.py 'sender:create_app()'
+
+Cada processo tem o seu pool do Postgres: mantenha
+WEB_CONCURRENCY * DB_POOL_MAX abaixo do max_connections do banco e
+DB_POOL_MAX >= GUNICORN_THREADS.
+"""
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', 8080)}"
+
+# Processos pré-forkados e threads por processo. Padrão fixo e pequeno: o
+# número de CPUs do host não diz nada sobre o limite do container nem sobre
+# as conexões que o Postgres aceita (WEB_CONCURRENCY * DB_POOL_MAX)
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# Conexões
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+backlog = int(os.getenv('GUNICORN_BACKLOG', 2048))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+# Recicla os processos de tempos em tempos (0 = nunca)
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+# Com preload a aplicação é importada uma vez no master (sobe mais rápido e
+# compartilha memória), mas um HUP não recarrega o código. Sem preload, um
+# `kill -HUP <master>` troca os processos um a um sem derrubar conexões.
+preload_app = os.getenv('GUNICORN_PRELOAD', 'false').lower() == 'true'
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+# Com mais de um processo, as métricas de cada um são somadas por este diretório
+if workers > 1:
+    os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'sender-metrics'))
+
+
+def on_starting(server):
+    from metrics import clear_metrics_dir
+    clear_metrics_dir(os.getenv('METRICS_DIR'))
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        # psycopg2 bloqueia o loop do gevent sem este patch
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+    if server.cfg.preload_app:
+        # A aplicação veio pronta do master: se alguma conexão foi aberta lá,
+        # o processo filho a esquece sem fechar o socket que o master usa
+        app = worker.app.wsgi()
+        app.pool._after_fork()
+        app.read_pool._after_fork()
+
+    from metrics import start_metrics_dump
+    start_metrics_dump(directory=os.getenv('METRICS_DIR'))
+
+
+def post_worker_init(worker):
+    # Conexões iniciais e thread do monitor só no processo que atende
+    if not hasattr(worker.wsgi, 'start'):
+        return
+    worker.wsgi.start()
+    worker.log.info("Worker %s: clientes Postgres/Redis inicializados", worker.pid)
+
+
+def worker_exit(server, worker):
+    from metrics import REGISTRY
+    try:
+        REGISTRY.dump(os.getenv('METRICS_DIR'))
+    except OSError as e:
+        server.log.warning("Worker %s: não foi possível gravar as métricas: %s", worker.pid, e)
+
+    app = getattr(worker, 'wsgi', None)
+    if app is not None and hasattr(app, 'pool'):
+        app.pool.closeall()
+        app.read_pool.closeall()
+
+
+def child_exit(server, worker):
+    from metrics import mark_process_dead
+    try:
+        mark_process_dead(worker.pid, os.getenv('METRICS_DIR'))
+    except OSError as e:
+        server.log.warning("Worker %s: não foi possível guardar as métricas: %s", worker.pid, e)
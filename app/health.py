@@ -0,0 +1,102 @@
+"""Monitor de saúde das dependências com circuit breaker
+
+Uma thread em segundo plano faz o PING no Redis e o SELECT 1 no Postgres a
+cada HEALTH_CHECK_INTERVAL segundos. O caminho da requisição só consulta o
+estado do breaker (O(1), sem round trip) e informa o resultado das próprias
+chamadas, então uma dependência fora do ar é detectada pelo monitor ou
+pelas falhas reais, o que vier primeiro.
+"""
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+HEALTH_CHECK_INTERVAL = float(os.getenv('HEALTH_CHECK_INTERVAL', 5))
+# Falhas seguidas que abrem o circuito e tempo (s) até tentar de novo
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', 3))
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', 10))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Circuit breaker clássico: fechado -> aberto -> meio aberto -> fechado"""
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Pode chamar a dependência? Com o circuito aberto só deixa passar
+        uma tentativa depois de `reset_timeout`"""
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        if self.state == CLOSED and not self.failures:
+            return
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"[HEALTH] {self.name} recovered, closing circuit")
+            self.state = CLOSED
+            self.failures = 0
+            self.last_error = None
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error) if error else None
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.error(f"[HEALTH] {self.name} unavailable, opening circuit: {error}")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def status(self):
+        return {'state': self.state, 'failures': self.failures, 'last_error': self.last_error}
+
+
+class HealthMonitor(threading.Thread):
+    """Verifica periodicamente cada dependência e alimenta o breaker dela"""
+
+    def __init__(self, checks, interval=HEALTH_CHECK_INTERVAL):
+        super().__init__(name='health-monitor', daemon=True)
+        self.checks = checks  # nome -> função que levanta exceção se falhar
+        self.interval = interval
+        self.breakers = {name: CircuitBreaker(name) for name in checks}
+        self._stop_event = threading.Event()
+
+    def check_all(self):
+        for name, check in self.checks.items():
+            breaker = self.breakers[name]
+            try:
+                check()
+                breaker.record_success()
+            except Exception as e:
+                breaker.record_failure(e)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.check_all()
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def status(self):
+        return {name: breaker.status() for name, breaker in self.breakers.items()}
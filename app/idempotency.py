@@ -0,0 +1,103 @@
+"""Supressão de requisições repetidas
+
+Antes de gravar, a API reserva a chave da requisição no Redis com um único
+`SET NX GET` (Redis >= 7.0; em versões anteriores, um SET NX seguido de
+GET, sem a mesma atomicidade): se ela já existia, a requisição é repetida e o
+resultado original é devolvido sem gravar nem enfileirar de novo. A chave é
+o cabeçalho `Idempotency-Key` (válido por IDEMPOTENCY_TTL) ou, sem ele, o
+hash do conteúdo, válido por IDEMPOTENCY_CONTENT_TTL, bem mais curto, para
+que o mesmo texto possa ser reenviado de propósito depois.
+"""
+import os
+import json
+import hashlib
+
+import redis
+
+KEY_PREFIX = 'idempotency:'
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', 86400))
+# 0 desliga o fallback por hash do conteúdo
+IDEMPOTENCY_CONTENT_TTL = int(os.getenv('IDEMPOTENCY_CONTENT_TTL', 300))
+# Valor da chave enquanto a primeira requisição ainda não terminou
+IN_PROGRESS = b'{}'
+
+
+def request_key(route, header_key, fields=None):
+    """Retorna (chave, ttl), ou (None, 0) se não há como identificar a requisição"""
+    if header_key:
+        digest = hashlib.sha256(header_key.encode()).hexdigest()
+        return f"{KEY_PREFIX}{route}:key:{digest}", IDEMPOTENCY_TTL
+    if fields is None or not IDEMPOTENCY_CONTENT_TTL:
+        return None, 0
+    digest = hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+    return f"{KEY_PREFIX}{route}:hash:{digest}", IDEMPOTENCY_CONTENT_TTL
+
+
+def stored_response(status, body):
+    return json.dumps({'status': status, 'body': body})
+
+
+def _rejects_get(error):
+    """Redis < 7.0 responde erro de sintaxe ao SET com NX e GET juntos"""
+    return 'syntax' in str(error).lower()
+
+
+def _loads(previous):
+    return None if previous is None else json.loads(previous)
+
+
+class IdempotencyCache:
+    def __init__(self, redis_conn):
+        self.redis = redis_conn
+        # Redis < 7.0 recusa NX junto com GET
+        self._legacy = False
+
+    def claim(self, key, ttl):
+        """Reserva a chave; retorna None se é a primeira vez, senão o resultado guardado
+
+        O resultado é {'status', 'body'}, ou {} se a primeira ainda está em andamento.
+        """
+        if not self._legacy:
+            try:
+                return _loads(self.redis.set(key, IN_PROGRESS, nx=True, ex=ttl, get=True))
+            except redis.exceptions.ResponseError as e:
+                if not _rejects_get(e):
+                    raise
+                self._legacy = True
+        if self.redis.set(key, IN_PROGRESS, nx=True, ex=ttl):
+            return None
+        # Expirou entre o SET e o GET: trata como ainda em andamento
+        return _loads(self.redis.get(key)) or {}
+
+    def complete(self, key, ttl, status, body):
+        self.redis.set(key, stored_response(status, body), xx=True, ex=ttl)
+
+    def release(self, key):
+        """Libera a chave quando a requisição falhou, para o cliente poder tentar de novo"""
+        self.redis.delete(key)
+
+
+class AsyncIdempotencyCache:
+    """O mesmo IdempotencyCache para o cliente redis.asyncio (sender_asgi.py)"""
+
+    def __init__(self, redis_conn):
+        self.redis = redis_conn
+        self._legacy = False
+
+    async def claim(self, key, ttl):
+        if not self._legacy:
+            try:
+                return _loads(await self.redis.set(key, IN_PROGRESS, nx=True, ex=ttl, get=True))
+            except redis.exceptions.ResponseError as e:
+                if not _rejects_get(e):
+                    raise
+                self._legacy = True
+        if await self.redis.set(key, IN_PROGRESS, nx=True, ex=ttl):
+            return None
+        return _loads(await self.redis.get(key)) or {}
+
+    async def complete(self, key, ttl, status, body):
+        await self.redis.set(key, stored_response(status, body), xx=True, ex=ttl)
+
+    async def release(self, key):
+        await self.redis.delete(key)
@@ -0,0 +1,112 @@
+"""Configuração de logs compartilhada pela API, pelo relay e pelo worker
+
+Quem loga (a requisição, a thread de envio) só coloca o registro em uma fila
+em memória: a formatação e a escrita no stdout acontecem na thread do
+QueueListener, fora do caminho quente. Use sempre o formato preguiçoso
+(`logger.info("x=%s", x)`), que só monta a string se o registro for
+escrito, e `debug_sampled` nos logs por mensagem.
+
+    LOG_LEVEL=INFO        # DEBUG liga os logs por mensagem
+    LOG_FORMAT=text       # ou json: um objeto por linha
+    LOG_SAMPLE_RATE=0.01  # fração dos logs por mensagem registrada em DEBUG
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.01))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Atributos de todo LogRecord; o que sobrar veio de `extra=` e vai para o JSON
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Um objeto JSON por linha, com os campos passados em `extra=`"""
+
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'service': self.service,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': record.getMessage(),
+        }
+        for field, value in vars(record).items():
+            if field not in _RECORD_FIELDS:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler que não formata a mensagem na thread de quem logou
+
+    O QueueHandler padrão chama format() no prepare(); aqui o registro vai
+    como está e o QueueListener formata. Os argumentos são lidos depois,
+    então não logue objetos que vão mudar logo em seguida.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def _start(handler, output):
+    global _listener
+    handler.queue = queue.SimpleQueue()
+    _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def setup_logging(service):
+    """Troca os handlers do logger raiz pela fila + escrita em segundo plano
+
+    Idempotente: chamadas repetidas (sender_with_worker importa o sender,
+    por exemplo) mantêm a configuração da primeira.
+    """
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter(service) if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT))
+    handler = DeferredQueueHandler(None)
+    _start(handler, output)
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    atexit.register(stop_logging)
+    # A thread do listener não sobrevive ao fork (gunicorn com preload_app):
+    # o processo filho ganha fila e thread próprias
+    os.register_at_fork(after_in_child=lambda: _start(handler, output))
+
+
+def stop_logging():
+    """Escreve o que ainda estiver na fila e para a thread de escrita"""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def debug_sampled(logger, msg, *args):
+    """logger.debug para os logs por mensagem: só LOG_SAMPLE_RATE deles são registrados"""
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < LOG_SAMPLE_RATE:
+        logger.debug(msg, *args)
@@ -0,0 +1,424 @@
+"""Métricas no formato de exposição do Prometheus
+
+Contadores e histogramas são divididos por thread: cada thread só escreve no
+seu próprio dicionário, sem lock, e a leitura (o scrape) soma todos. Os
+gauges (profundidade da fila, envios em andamento) são calculados na hora
+do scrape por uma função. A API expõe `/metrics` e o worker sobe um
+servidor HTTP próprio em METRICS_PORT.
+
+Com o gunicorn e mais de um processo, o gunicorn.conf.py define METRICS_DIR:
+cada processo grava ali, a cada METRICS_DUMP_INTERVAL segundos, os seus
+contadores, histogramas e gauges por processo (o pool do Postgres), e o
+scrape soma esses arquivos aos valores do processo que o atendeu. Quando um
+processo morre, o master guarda os contadores dele em `dead.json`, para que
+os totais não voltem atrás. Os gauges lidos do Redis são os mesmos em todos
+os processos e não são somados.
+"""
+import os
+import glob
+import json
+import time
+import bisect
+import tempfile
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    # O id da thread de verdade mesmo com o monkey patch do gevent
+    from gevent.monkey import get_original
+    _get_ident = get_original('_thread', 'get_ident')
+except ImportError:
+    from _thread import get_ident as _get_ident
+
+logger = logging.getLogger(__name__)
+
+# Porta do servidor de métricas do worker; 0 desliga
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9100))
+# Diretório compartilhado pelos processos do gunicorn; vazio = um processo só
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_DUMP_INTERVAL = float(os.getenv('METRICS_DUMP_INTERVAL', 5))
+DEAD_FILE = 'dead.json'
+_compacting = False
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Segundos: de uma consulta rápida ao banco até uma chamada lenta ao provedor
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Sharded:
+    """Um dicionário por thread do sistema; só a primeira escrita de cada thread usa o lock
+
+    A chave é o id da thread do sistema operacional, não um threading.local:
+    com o gevent o local vira um por greenlet (um por requisição), e os
+    dicionários se acumulariam para sempre. Os greenlets de uma mesma thread
+    dividem o dicionário, o que é seguro porque não trocam de contexto no
+    meio de um incremento; ids de threads que terminaram são reaproveitados.
+    """
+
+    shared = True
+
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._shards = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        ident = _get_ident()
+        shard = self._shards.get(ident)
+        if shard is None:
+            with self._lock:
+                shard = self._shards.setdefault(ident, {})
+        return shard
+
+    def _snapshots(self):
+        # dict.copy() é atômico sob o GIL, mesmo com a thread dona escrevendo
+        with self._lock:
+            shards = list(self._shards.values())
+        return [shard.copy() for shard in shards]
+
+
+class Counter(_Sharded):
+    type = 'counter'
+
+    @staticmethod
+    def add(totals, labels, value):
+        totals[labels] = totals.get(labels, 0) + value
+
+    def inc(self, labels=(), n=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + n
+
+    def values(self):
+        totals = {}
+        for shard in self._snapshots():
+            for labels, value in shard.items():
+                self.add(totals, labels, value)
+        return totals
+
+    def total(self):
+        return sum(self.values().values())
+
+    def render(self, others=()):
+        """`others`: (labels, valor) dos outros processos"""
+        totals = self.values()
+        for labels, value in others:
+            self.add(totals, labels, value)
+        return [f'{self.name}{_labels(self.labels, labels)} {_number(value)}'
+                for labels, value in sorted(totals.items())]
+
+
+class Histogram(_Sharded):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        shard = self._shard()
+        entry = shard.get(labels)
+        if entry is None:
+            # [contagem por faixa (a última é +Inf), soma, total]
+            entry = shard[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    @contextmanager
+    def time(self, labels=()):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, labels)
+
+    @staticmethod
+    def add(totals, labels, entry):
+        counts, total, count = entry
+        merged = totals.get(labels)
+        if merged is None:
+            totals[labels] = [list(counts), total, count]
+            return
+        merged[0] = [a + b for a, b in zip(merged[0], counts)]
+        merged[1] += total
+        merged[2] += count
+
+    def values(self):
+        totals = {}
+        for shard in self._snapshots():
+            for labels, entry in shard.items():
+                self.add(totals, labels, entry)
+        return totals
+
+    def render(self, others=()):
+        totals = self.values()
+        for labels, entry in others:
+            self.add(totals, labels, entry)
+        lines = []
+        for labels, (counts, total, count) in sorted(totals.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f'{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, labels)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labels, labels)} {count}')
+        return lines
+
+
+class Gauge:
+    """Valor calculado no scrape: `callback()` retorna {valores dos labels: número}
+
+    Com `per_process` o valor é de cada processo e é somado aos dos outros
+    processos do gunicorn; sem ele (ex.: lido do Redis) é o mesmo em todos.
+    """
+
+    type = 'gauge'
+    add = staticmethod(Counter.add)
+
+    def __init__(self, name, documentation, labels, callback, per_process=False):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.callback = callback
+        self.shared = per_process
+
+    def values(self):
+        try:
+            return self.callback()
+        except Exception as e:
+            # Redis fora do ar não pode derrubar o scrape inteiro
+            logger.warning("Métrica %s indisponível: %s", self.name, e)
+            return None
+
+    def render(self, others=()):
+        values = self.values()
+        if values is None:
+            return []
+        values = dict(values)
+        for labels, value in others:
+            self.add(values, labels, value)
+        return [f'{self.name}{_labels(self.labels, labels)} {_number(value)}'
+                for labels, value in sorted(values.items())]
+
+
+_TYPES = {'counter': Counter, 'histogram': Histogram, 'gauge': Gauge}
+
+
+def _path(directory, pid):
+    return os.path.join(directory, f'{pid}.json')
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(path, data):
+    # Grava em um temporário e troca: quem lê nunca vê o arquivo pela metade
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        # Registrar de novo com o mesmo nome troca a métrica (ex.: novo gauge após o fork)
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name, documentation, callback, labels=(), per_process=False):
+        return self._register(Gauge(name, documentation, labels, callback, per_process))
+
+    def snapshot(self):
+        """Valores deste processo que são somados aos dos outros, em um formato JSON"""
+        with self._lock:
+            metrics = [metric for metric in self._metrics.values() if metric.shared]
+        data = {}
+        for metric in metrics:
+            values = metric.values()
+            if values is not None:
+                data[metric.name] = {'type': metric.type,
+                                     'values': [[list(labels), value] for labels, value in values.items()]}
+        return data
+
+    def dump(self, directory=METRICS_DIR):
+        if directory:
+            _write(_path(directory, os.getpid()), self.snapshot())
+
+    def _others(self, directory):
+        """{nome: [(labels, valor)]} gravados pelos outros processos (vivos e mortos)"""
+        dead = _load(os.path.join(directory, DEAD_FILE)) or {}
+        # Já somados em DEAD_FILE, mas talvez ainda não apagados
+        skip = {_path(directory, os.getpid())} | {os.path.join(directory, name) for name in dead.get('files', ())}
+        sources = [dead.get('metrics', {})]
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            if path not in skip and os.path.basename(path) != DEAD_FILE:
+                sources.append(_load(path) or {})
+        others = {}
+        for data in sources:
+            for name, metric in data.items():
+                others.setdefault(name, []).extend((tuple(labels), value) for labels, value in metric['values'])
+        return others
+
+    def render(self, directory=METRICS_DIR):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        others = self._others(directory) if directory else {}
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.render(others.get(metric.name, ()) if metric.shared else ()))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def start_metrics_dump(registry=REGISTRY, directory=METRICS_DIR, interval=METRICS_DUMP_INTERVAL):
+    """Grava as métricas deste processo em `directory` a cada `interval` segundos"""
+    if not directory:
+        return None
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                registry.dump(directory)
+            except OSError as e:
+                logger.warning("Não foi possível gravar as métricas em %s: %s", directory, e)
+
+    thread = threading.Thread(target=run, name='metrics-dump', daemon=True)
+    thread.start()
+    return thread
+
+
+def clear_metrics_dir(directory=METRICS_DIR):
+    """Apaga o que sobrou de uma execução anterior (master do gunicorn, ao subir)"""
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        os.remove(path)
+
+
+def _merge(into, data):
+    for name, metric in data.items():
+        add = _TYPES[metric['type']].add
+        totals = {tuple(labels): value for labels, value in into.get(name, {}).get('values', [])}
+        for labels, value in metric['values']:
+            add(totals, tuple(labels), value)
+        into[name] = {'type': metric['type'], 'values': [[list(labels), value] for labels, value in totals.items()]}
+    return into
+
+
+def mark_process_dead(pid, directory=METRICS_DIR):
+    """Guarda os contadores e histogramas de um processo morto; os gauges dele somem
+
+    Chamado pelo master do gunicorn no child_exit, que pode ser reentrante
+    (SIGCHLD): cada processo morto vira um `dead-<pid>.json`, e só uma
+    chamada por vez junta esses arquivos em DEAD_FILE.
+    """
+    global _compacting
+    if not directory:
+        return
+    path = _path(directory, pid)
+    data = _load(path)
+    if data is None:
+        return
+    _write(os.path.join(directory, f'dead-{pid}.json'),
+           {name: metric for name, metric in data.items() if metric['type'] != 'gauge'})
+    os.remove(path)
+    if _compacting:
+        return
+    _compacting = True
+    try:
+        dead_path = os.path.join(directory, DEAD_FILE)
+        metrics = (_load(dead_path) or {}).get('metrics', {})
+        merged = glob.glob(os.path.join(directory, 'dead-*.json'))
+        for merged_path in merged:
+            _merge(metrics, _load(merged_path) or {})
+        _write(dead_path, {'files': [os.path.basename(path) for path in merged], 'metrics': metrics})
+        for merged_path in merged:
+            os.remove(merged_path)
+    finally:
+        _compacting = False
+
+
+def register_queue_gauges(redis_conn, transport, registry=REGISTRY):
+    """Profundidade das filas, novas tentativas, mortas e agendadas, lidas do Redis no scrape"""
+    from queues import lane_depths
+    from retry import RetryScheduler
+    from schedule import Scheduler
+
+    registry.gauge('emails_queue_depth', 'Mensagens aguardando na fila, por prioridade',
+                   lambda: {(priority,): depth for priority, depth in lane_depths(redis_conn, transport).items()},
+                   ('priority',))
+    registry.gauge('emails_retry_pending', 'Mensagens aguardando nova tentativa',
+                   lambda: {(): RetryScheduler(redis_conn, transport).info()['retry']})
+    registry.gauge('emails_dead_letters', 'Mensagens na fila de mortas',
+                   lambda: {(): RetryScheduler(redis_conn, transport).info()['dead']})
+    registry.gauge('emails_scheduled', 'Mensagens com envio agendado',
+                   lambda: {(): Scheduler(redis_conn, transport).info()['scheduled']})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve GET /metrics em uma thread daemon; retorna o servidor (ou None se desligado)"""
+    if not port:
+        return None
+    server = ThreadingHTTPServer(('0.0.0.0', port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
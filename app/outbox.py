@@ -0,0 +1,173 @@
+"""Outbox transacional: o Postgres é a fonte da verdade da fila
+
+Com OUTBOX=true a API só grava a linha em `emails` com status `pendente` (e
+um NOTIFY na mesma transação). Este relay pega as linhas pendentes em lotes
+com `FOR UPDATE SKIP LOCKED`, enfileira no Redis em um único pipeline e
+marca como `enfileirada` antes do commit, então várias réplicas do relay
+podem rodar juntas sem pegar a mesma linha. Se o relay cair entre o push e
+o commit, o lote é enfileirado de novo (entrega pelo menos uma vez).
+
+Mesmo sem OUTBOX, a API marca como `pendente` o que não conseguiu enfileirar
+(Redis fora do ar), e o relay recupera essas linhas.
+
+    python outbox.py
+"""
+import os
+import time
+import signal
+import select
+import logging
+import threading
+from datetime import datetime
+
+import psycopg2
+import psycopg2.extensions
+import redis
+
+from queues import Producer, PRIORITY_DEFAULT
+from schedule import SCHEDULED
+from logs import setup_logging
+from codec import encode
+from db_pool import dsn_from_env
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pendente'
+QUEUED = 'enfileirada'
+
+OUTBOX_CHANNEL = 'emails_outbox'
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 1000))
+# Intervalo (s) máximo entre as varreduras quando nenhum NOTIFY chega
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 5))
+
+CLAIM_SQL = """
+SELECT id, data, assunto, mensagem, email, template_id, variaveis, corpo_hash, prioridade, agendado_para
+FROM emails
+WHERE status = %s
+ORDER BY id
+LIMIT %s
+FOR UPDATE SKIP LOCKED
+"""
+MARK_SQL = 'UPDATE emails SET status = %s WHERE id = ANY(%s)'
+
+
+def build_payload(msg_id, data, assunto, mensagem, email, template=None, variaveis=None, corpo_hash=None,
+                  prioridade=PRIORITY_DEFAULT):
+    """Entrada da fila para uma linha de `emails`, no formato de QUEUE_CODEC
+
+    Mensagens de template levam só o id dele e as variáveis, e corpos grandes
+    só o hash (`corpo`); o worker renderiza ou busca o conteúdo. A prioridade
+    só vai na entrada quando não é a padrão.
+    """
+    payload = {'id': msg_id, 'data': data.isoformat(), 'email': email}
+    if prioridade != PRIORITY_DEFAULT:
+        payload['prioridade'] = prioridade
+    if template is not None:
+        payload.update(template=template, variaveis=variaveis or {})
+        if assunto:
+            payload['assunto'] = assunto
+    elif corpo_hash is not None:
+        payload.update(assunto=assunto, corpo=corpo_hash)
+    else:
+        payload.update(assunto=assunto, mensagem=mensagem)
+    return encode(payload)
+
+
+class OutboxRelay:
+    """Move as linhas pendentes do Postgres para a fila do Redis"""
+
+    def __init__(self, dsn, redis_conn, batch_size=OUTBOX_BATCH_SIZE):
+        self.dsn = dsn
+        self.producer = Producer(redis_conn)
+        self.batch_size = batch_size
+        self.conn = None
+        self.listener = None
+
+    def connect(self):
+        self.close()
+        self.conn = psycopg2.connect(self.dsn)
+        # Conexão separada em autocommit só para receber os NOTIFY
+        self.listener = psycopg2.connect(self.dsn)
+        self.listener.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with self.listener.cursor() as cur:
+            cur.execute(f'LISTEN {OUTBOX_CHANNEL}')
+
+    def close(self):
+        for conn in (self.conn, self.listener):
+            if conn is not None and not conn.closed:
+                conn.close()
+        self.conn = self.listener = None
+
+    def relay_batch(self):
+        """Enfileira um lote de linhas pendentes; retorna quantas moveu"""
+        with self.conn:  # commit no sucesso, rollback (e locks liberados) no erro
+            with self.conn.cursor() as cur:
+                cur.execute(CLAIM_SQL, (PENDING, self.batch_size))
+                rows = cur.fetchall()
+                if not rows:
+                    return 0
+                payloads = [build_payload(*row[:-1]) for row in rows]
+                self.producer.push(payloads, chunk_size=self.batch_size,
+                                   priorities=[row[-2] for row in rows], send_at=[row[-1] for row in rows])
+                now = datetime.utcnow()
+                scheduled = [row[0] for row in rows if row[-1] is not None and row[-1] > now]
+                queued = [row[0] for row in rows if row[-1] is None or row[-1] <= now]
+                for status, ids in ((SCHEDULED, scheduled), (QUEUED, queued)):
+                    if ids:
+                        cur.execute(MARK_SQL, (status, ids))
+        return len(rows)
+
+    def wait(self, timeout):
+        """Dorme até chegar um NOTIFY ou passar `timeout` segundos"""
+        if select.select([self.listener], [], [], timeout)[0]:
+            self.listener.poll()
+            self.listener.notifies.clear()
+
+    def run(self, running):
+        self.connect()
+        while running():
+            try:
+                moved = self.relay_batch()
+                if moved:
+                    logger.info("[OUTBOX] %d message(s) queued", moved)
+                if moved < self.batch_size:
+                    self.wait(OUTBOX_POLL_INTERVAL)
+            except (psycopg2.Error, redis.exceptions.RedisError) as e:
+                logger.error(f"[OUTBOX ERROR] {e}")
+                time.sleep(2)
+                if self.conn.closed or self.listener.closed:
+                    try:
+                        self.connect()
+                    except psycopg2.Error as e:
+                        logger.error(f"[OUTBOX ERROR] Reconnect failed: {e}")
+        self.close()
+
+
+def main():
+    setup_logging('relay')
+    dsn = dsn_from_env()
+    redis_conn = redis.StrictRedis(
+        host=os.getenv('REDIS_HOST', 'queue'),
+        port=6379,
+        password=os.getenv('REDIS_PASSWORD'),
+        db=0,
+        socket_connect_timeout=5,
+        socket_timeout=5,
+        retry_on_timeout=True
+    )
+
+    stopping = threading.Event()
+
+    def shutdown(signum, _frame):
+        logger.info(f"[OUTBOX] Signal {signum} received, stopping")
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    logger.info(f"[OUTBOX] Relay started (batch={OUTBOX_BATCH_SIZE}, poll={OUTBOX_POLL_INTERVAL}s)")
+    OutboxRelay(dsn, redis_conn).run(lambda: not stopping.is_set())
+
+
+if __name__ == '__main__':
+    main()
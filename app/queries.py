@@ -0,0 +1,131 @@
+"""Consultas de leitura sobre a tabela `emails`
+
+A listagem usa paginação por keyset em (data, id), do mais recente para o
+mais antigo: cada página devolve o cursor `proximo`, e a seguinte começa
+logo depois dele usando os índices, sem OFFSET. As linhas vêm de um cursor
+do lado do servidor e são escritas na resposta aos poucos, então nem a API
+nem o banco montam a página inteira em memória.
+"""
+import os
+import json
+import uuid
+import logging
+from contextlib import ExitStack
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ('pendente', 'agendada', 'enfileirada', 'enviada', 'reagendada', 'falhou')
+PAGE_DEFAULT = int(os.getenv('EMAILS_PAGE_DEFAULT', 100))
+PAGE_MAX = int(os.getenv('EMAILS_PAGE_MAX', 10000))
+# Linhas buscadas do cursor do servidor por round trip
+FETCH_SIZE = 1000
+
+COLUMNS = ('id', 'data', 'assunto', 'email', 'status', 'prioridade', 'agendado_para', 'tentativas', 'provedor_id',
+           'enviado_em', 'erro')
+
+
+def encode_cursor(data, msg_id):
+    return f"{data.isoformat()},{msg_id}"
+
+
+def decode_cursor(cursor):
+    """Inverso do encode_cursor; levanta ValueError se o cursor não veio dele"""
+    data, _, msg_id = cursor.rpartition(',')
+    try:
+        return datetime.fromisoformat(data), int(msg_id)
+    except ValueError:
+        raise ValueError("cursor apos inválido") from None
+
+
+def parse_datetime(params, name):
+    try:
+        return datetime.fromisoformat(params[name])
+    except ValueError:
+        raise ValueError(f"{name} deve ser uma data ISO 8601") from None
+
+
+def to_dict(columns, row):
+    return {column: value.isoformat() if isinstance(value, datetime) else value
+            for column, value in zip(columns, row)}
+
+
+def parse_filters(params):
+    """Monta o WHERE a partir da query string; levanta ValueError se inválida
+
+    Filtros: email, status, desde e ate (ISO 8601, sobre `data`), apos
+    (cursor da página anterior) e limite.
+    """
+    where = []
+    args = []
+    if params.get('email'):
+        where.append('email = %s')
+        args.append(params['email'])
+    if params.get('status'):
+        if params['status'] not in STATUSES:
+            raise ValueError(f"status deve ser um de {list(STATUSES)}")
+        where.append('status = %s')
+        args.append(params['status'])
+    if params.get('desde'):
+        where.append('data >= %s')
+        args.append(parse_datetime(params, 'desde'))
+    if params.get('ate'):
+        where.append('data < %s')
+        args.append(parse_datetime(params, 'ate'))
+    if params.get('apos'):
+        where.append('(data, id) < (%s, %s)')
+        args.extend(decode_cursor(params['apos']))
+
+    try:
+        limit = int(params.get('limite') or PAGE_DEFAULT)
+    except ValueError:
+        raise ValueError("limite deve ser um inteiro") from None
+    if not 1 <= limit <= PAGE_MAX:
+        raise ValueError(f"limite deve estar entre 1 e {PAGE_MAX}")
+    return where, args, limit
+
+
+def get_email(pool, msg_id):
+    """Uma mensagem com o corpo, ou None"""
+    columns = COLUMNS + ('mensagem', 'template_id', 'variaveis', 'corpo_hash')
+    # Corpos guardados por referência (bodies.py) voltam no campo mensagem
+    select = ', '.join('COALESCE(e.mensagem, c.conteudo)' if column == 'mensagem' else f'e.{column}'
+                       for column in columns)
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT {select} FROM emails e LEFT JOIN corpos c ON c.hash = e.corpo_hash "
+                        f"WHERE e.id = %s", (msg_id,))
+            row = cur.fetchone()
+        conn.rollback()
+    return to_dict(columns, row) if row else None
+
+
+def stream_emails(pool, where, args, limit):
+    """Executa a consulta e retorna a página como pedaços de JSON: {"emails": [...], "proximo": cursor}
+
+    A consulta roda antes de retornar, então um erro do banco sobe para quem
+    chamou antes de qualquer byte da resposta; a conexão é devolvida ao pool
+    quando o gerador termina ou é fechado.
+    """
+    sql = f"SELECT {', '.join(COLUMNS)} FROM emails " \
+          f"{'WHERE ' + ' AND '.join(where) if where else ''} " \
+          f"ORDER BY data DESC, id DESC LIMIT %s"
+    with ExitStack() as stack:
+        conn = stack.enter_context(pool.connection())
+        cur = stack.enter_context(conn.cursor(name=f'emails_{uuid.uuid4().hex}'))
+        cur.itersize = FETCH_SIZE
+        cur.execute(sql, args + [limit])
+        return _page(cur, limit, stack.pop_all())
+
+
+def _page(cur, limit, cleanup):
+    count = 0
+    last = None
+    with cleanup:
+        yield '{"emails": ['
+        for row in cur:
+            yield (',' if count else '') + json.dumps(to_dict(COLUMNS, row))
+            count += 1
+            last = row
+    proximo = encode_cursor(last[1], last[0]) if count == limit else None
+    yield f'], "proximo": {json.dumps(proximo)}}}'
@@ -0,0 +1,618 @@
+"""Fila confiável de mensagens sobre o Redis
+
+Dois transportes, escolhidos por QUEUE_TRANSPORT:
+
+- `list` (padrão): cada consumidor move as mensagens da lista `sender` para
+  a sua lista de processamento (`sender:processing:<consumidor>`) e só as
+  remove de lá depois que o provedor confirmou o envio.
+- `stream`: as mensagens vão para o stream `sender:stream` e são lidas pelo
+  grupo de consumidores `workers` com XREADGROUP; o PEL do grupo faz o papel
+  da lista de processamento e o stream guarda o histórico para replay.
+
+Nos dois casos um consumidor vivo renova a chave `sender:consumer:<nome>`;
+quando ela expira, o reaper de qualquer outro worker devolve à fila as
+mensagens que ficaram presas com ele.
+
+Cada prioridade (PRIORITIES, da maior para a menor) tem a sua fila: a
+`normal` continua sendo `sender` / `sender:stream` e as outras ganham o
+sufixo (`sender:alta`, `sender:stream:baixa`). Os consumidores sempre
+esvaziam as filas de maior prioridade antes de olhar as seguintes, então um
+disparo em massa em `baixa` não atrasa um e-mail transacional em `alta`.
+"""
+import os
+import time
+import socket
+import logging
+import uuid
+from datetime import datetime, timezone
+
+import redis
+
+from codec import decode
+
+logger = logging.getLogger(__name__)
+
+QUEUE_TRANSPORT = os.getenv('QUEUE_TRANSPORT', 'list').lower()
+
+QUEUE_KEY = 'sender'
+STREAM_KEY = 'sender:stream'
+# Mensagens com envio agendado (sorted set por prioridade, score = horário do envio)
+SCHEDULED_KEY = 'sender:agendadas'
+PRIORITIES = ('alta', 'normal', 'baixa')
+PRIORITY_DEFAULT = 'normal'
+STREAM_GROUP = 'workers'
+# Tamanho aproximado mantido no stream (histórico para replay)
+STREAM_MAXLEN = int(os.getenv('QUEUE_STREAM_MAXLEN', 1000000))
+PROCESSING_PREFIX = 'sender:processing:'
+HEARTBEAT_PREFIX = 'sender:consumer:'
+CONSUMERS_KEY = 'sender:consumers'
+
+# Segundos sem heartbeat para um consumidor ser considerado morto
+HEARTBEAT_TTL = int(os.getenv('QUEUE_HEARTBEAT_TTL', 30))
+# Intervalo (s) entre as varreduras do reaper
+REAP_INTERVAL = float(os.getenv('QUEUE_REAP_INTERVAL', 15))
+# Com a fila vazia o consumidor bloqueia na fila de maior prioridade e confere
+# as outras a cada PRIORITY_POLL_INTERVAL segundos
+PRIORITY_POLL_INTERVAL = float(os.getenv('QUEUE_PRIORITY_POLL_INTERVAL', 0.1))
+
+# Move até ARGV[1] mensagens para o fim da lista de processamento (KEYS[1]),
+# esvaziando as filas KEYS[2..n] na ordem, da maior prioridade para a menor
+DRAIN_SCRIPT = """
+local wanted = tonumber(ARGV[1])
+local batch = {}
+for k = 2, #KEYS do
+    if #batch >= wanted then
+        break
+    end
+    local items = redis.call('LRANGE', KEYS[k], 0, wanted - #batch - 1)
+    if #items > 0 then
+        redis.call('LTRIM', KEYS[k], #items, -1)
+        redis.call('RPUSH', KEYS[1], unpack(items))
+        for i = 1, #items do
+            batch[#batch + 1] = items[i]
+        end
+    end
+end
+return batch
+"""
+
+# Tira as mensagens da lista de processamento e as devolve ao fim da fila
+REQUEUE_SCRIPT = """
+local moved = 0
+for i = 1, #ARGV do
+    if redis.call('LREM', KEYS[1], 1, ARGV[i]) > 0 then
+        redis.call('RPUSH', KEYS[2], ARGV[i])
+        moved = moved + 1
+    end
+end
+return moved
+"""
+
+# Passa para a lista de processamento KEYS[2] tudo que um consumidor morto
+# deixou em KEYS[1], se o heartbeat dele ainda estiver expirado, e retorna as
+# mensagens: a prioridade de cada uma só é conhecida depois de decodificar
+REAP_SCRIPT = """
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    return {}
+end
+local items = redis.call('LRANGE', KEYS[1], 0, -1)
+for i = 1, #items do
+    redis.call('RPUSH', KEYS[2], items[i])
+end
+redis.call('DEL', KEYS[1])
+redis.call('SREM', KEYS[4], ARGV[1])
+return items
+"""
+
+# Devolve ao início da fila KEYS[2], na ordem original, as mensagens ARGV que
+# ainda estão na lista de processamento KEYS[1]
+RESTORE_SCRIPT = """
+local moved = 0
+for i = #ARGV, 1, -1 do
+    if redis.call('LREM', KEYS[1], 1, ARGV[i]) > 0 then
+        redis.call('LPUSH', KEYS[2], ARGV[i])
+        moved = moved + 1
+    end
+end
+return moved
+"""
+
+
+def lane_key(priority, base=QUEUE_KEY):
+    """Chave da fila de uma prioridade (a `normal` usa a chave original)"""
+    return base if priority == PRIORITY_DEFAULT else f"{base}:{priority}"
+
+
+def message_priority(mensagem):
+    """Prioridade de uma mensagem já decodificada; a padrão se ausente ou inválida"""
+    priority = mensagem.get('prioridade')
+    return priority if priority in PRIORITIES else PRIORITY_DEFAULT
+
+
+def priority_of(mensagem_raw):
+    """Prioridade de uma entrada da fila; a padrão se ilegível"""
+    try:
+        return message_priority(decode(mensagem_raw))
+    except (ValueError, AttributeError):
+        return PRIORITY_DEFAULT
+
+
+def consumer_name():
+    """Nome único do consumidor (WORKER_NAME ou host-pid-aleatório)"""
+    return os.getenv('WORKER_NAME') or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class ListQueue:
+    """Consumo confiável das listas `sender` com rastreio das mensagens em andamento
+
+    `fetch()` retorna pares (id, mensagem_raw); na lista o id é a própria
+    mensagem. Toda mensagem retornada precisa de um `ack()` (enviada ou
+    descartada) ou `nack()` (volta para a fila da sua prioridade).
+    """
+
+    transport = 'list'
+
+    def __init__(self, redis_conn, consumer=None, keys=None):
+        self.redis = redis_conn
+        # Da maior prioridade para a menor
+        self.keys = keys or [lane_key(priority) for priority in PRIORITIES]
+        self.consumer = consumer or consumer_name()
+        self.processing_key = PROCESSING_PREFIX + self.consumer
+        self.heartbeat_key = HEARTBEAT_PREFIX + self.consumer
+        self._drain = redis_conn.register_script(DRAIN_SCRIPT)
+        self._requeue = redis_conn.register_script(REQUEUE_SCRIPT)
+        self._reap = redis_conn.register_script(REAP_SCRIPT)
+        self._restore = redis_conn.register_script(RESTORE_SCRIPT)
+        self._next_heartbeat = 0
+        self._next_reap = 0
+
+    def heartbeat(self, force=False):
+        now = time.monotonic()
+        if not force and now < self._next_heartbeat:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.set(self.heartbeat_key, int(time.time()), ex=HEARTBEAT_TTL)
+        pipe.sadd(CONSUMERS_KEY, self.consumer)
+        pipe.execute()
+        self._next_heartbeat = now + HEARTBEAT_TTL / 3
+
+    def wait_first(self, timeout):
+        """Bloqueia até `timeout` pela primeira mensagem de qualquer prioridade
+
+        O BLMOVE só espera em uma lista: fica na de maior prioridade (que
+        acorda na hora) e esvazia as demais a cada PRIORITY_POLL_INTERVAL.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            items = self._drain(keys=[self.processing_key] + self.keys, args=[1])
+            if items:
+                return items[0]
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            wait = remaining if len(self.keys) == 1 else min(remaining, PRIORITY_POLL_INTERVAL)
+            first = self.redis.blmove(self.keys[0], self.processing_key, wait, 'LEFT', 'RIGHT')
+            if first is not None:
+                return first
+
+    def fetch(self, max_size, linger=0, timeout=5):
+        """Retira até `max_size` mensagens, bloqueando até `timeout` pela primeira
+
+        Depois da primeira espera no máximo `linger` segundos para completar o
+        lote. Retorna [] se as filas continuaram vazias.
+        """
+        self.heartbeat()
+        first = self.wait_first(timeout)
+        if first is None:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + linger
+        while len(batch) < max_size:
+            wanted = max_size - len(batch)
+            items = self._drain(keys=[self.processing_key] + self.keys, args=[wanted])
+            batch.extend(items)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if len(items) < wanted:
+                time.sleep(min(0.01, remaining))
+        return [(raw, raw) for raw in batch]
+
+    def ack(self, ids):
+        """Confirma o processamento, removendo da lista de processamento"""
+        if not ids:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for entry_id in ids:
+            pipe.lrem(self.processing_key, 1, entry_id)
+        pipe.execute()
+
+    def nack(self, entries):
+        """Devolve as entradas (id, mensagem_raw) ao fim da fila da sua prioridade"""
+        if not entries:
+            return 0
+        lanes = {}
+        for entry_id, raw in entries:
+            lanes.setdefault(lane_key(priority_of(raw)), []).append(entry_id)
+        return sum(self._requeue(keys=[self.processing_key, lane], args=ids)
+                   for lane, ids in lanes.items())
+
+    def reap(self, force=False):
+        """Devolve à fila as mensagens presas em consumidores sem heartbeat
+
+        Elas já esperaram demais, então voltam no início da fila da sua
+        prioridade. Se este consumidor cair no meio do caminho, elas ficam na
+        lista de processamento dele e o próximo reap as recupera.
+        """
+        now = time.monotonic()
+        if not force and now < self._next_reap:
+            return 0
+        self._next_reap = now + REAP_INTERVAL
+
+        recovered = 0
+        for member in self.redis.smembers(CONSUMERS_KEY):
+            consumer = member.decode() if isinstance(member, bytes) else member
+            if consumer == self.consumer:
+                continue
+            items = self._reap(keys=[PROCESSING_PREFIX + consumer, self.processing_key,
+                                     HEARTBEAT_PREFIX + consumer, CONSUMERS_KEY],
+                               args=[consumer])
+            lanes = {}
+            for raw in items:
+                lanes.setdefault(lane_key(priority_of(raw)), []).append(raw)
+            count = sum(self._restore(keys=[self.processing_key, lane], args=raws)
+                        for lane, raws in lanes.items())
+            if count:
+                logger.warning(f"♻️ {count} mensagem(ns) do consumidor {consumer} devolvida(s) à fila")
+            recovered += count
+        return recovered
+
+    def close(self):
+        """Devolve o que ainda estiver em processamento e sai do registro"""
+        leftovers = self.redis.lrange(self.processing_key, 0, -1)
+        if leftovers:
+            self.nack([(raw, raw) for raw in leftovers])
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.delete(self.heartbeat_key)
+        pipe.srem(CONSUMERS_KEY, self.consumer)
+        pipe.execute()
+
+    def info(self):
+        """Profundidade das filas e mensagens em andamento por consumidor"""
+        consumers = sorted(m.decode() if isinstance(m, bytes) else m
+                           for m in self.redis.smembers(CONSUMERS_KEY))
+        pipe = self.redis.pipeline(transaction=False)
+        for key in self.keys:
+            pipe.llen(key)
+        for consumer in consumers:
+            pipe.llen(PROCESSING_PREFIX + consumer)
+        results = pipe.execute()
+        lanes, in_flight = results[:len(self.keys)], results[len(self.keys):]
+        return {
+            'transport': 'list',
+            'depth': sum(lanes),
+            'lanes': dict(zip(self.keys, lanes)),
+            'consumers': {c: {'pending': n} for c, n in zip(consumers, in_flight)},
+        }
+
+
+# Move até ARGV[1] mensagens da lista antiga para o stream (compatibilidade
+# com produtores que ainda fazem RPUSH em `sender`)
+MIGRATE_BATCH = 1000
+MIGRATE_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('LTRIM', KEYS[1], #items, -1)
+    for i = 1, #items do
+        redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], '*', 'payload', items[i])
+    end
+end
+return #items
+"""
+
+
+def _entries(stream, response):
+    """Converte a resposta de XREADGROUP/XCLAIM em pares ((stream, id), payload)"""
+    entries = []
+    for entry_id, fields in response:
+        if fields is None:  # entrada já removida do stream pelo MAXLEN
+            continue
+        entries.append(((stream, entry_id), fields.get(b'payload', fields.get('payload'))))
+    return entries
+
+
+def _group_lag(redis_conn, stream, group=STREAM_GROUP):
+    """(atraso, pendentes) do grupo no stream: entradas ainda não entregues e não confirmadas
+
+    O Redis < 7.0 não informa o atraso; nesse caso vale o XLEN, que também
+    conta o histórico já confirmado.
+    """
+    info = next((g for g in redis_conn.xinfo_groups(stream) if g['name'] in (group, group.encode())), {})
+    lag = info.get('lag')
+    if lag is None:
+        lag = redis_conn.xlen(stream)
+    return lag, info.get('pending', 0)
+
+
+def _by_stream(ids):
+    streams = {}
+    for stream, entry_id in ids:
+        streams.setdefault(stream, []).append(entry_id)
+    return streams.items()
+
+
+class StreamQueue:
+    """Consumo dos streams `sender:stream` pelo grupo `workers`
+
+    Mesma interface da ListQueue. O id de cada entrada é o par (stream, id);
+    `ack()` faz XACK e `nack()` reescreve a mensagem no fim do seu stream.
+    """
+
+    transport = 'stream'
+
+    def __init__(self, redis_conn, consumer=None, streams=None, group=STREAM_GROUP):
+        self.redis = redis_conn
+        # Da maior prioridade para a menor
+        self.streams = streams or [lane_key(priority, STREAM_KEY) for priority in PRIORITIES]
+        self.group = group
+        self.consumer = consumer or consumer_name()
+        self.heartbeat_key = HEARTBEAT_PREFIX + self.consumer
+        self._migrate = redis_conn.register_script(MIGRATE_SCRIPT)
+        self._next_heartbeat = 0
+        self._next_reap = 0
+        self.ensure_group()
+
+    def ensure_group(self):
+        for stream in self.streams:
+            try:
+                # id 0: o grupo também lê o que já estava no stream antes dele existir
+                self.redis.xgroup_create(stream, self.group, id='0', mkstream=True)
+            except redis.exceptions.ResponseError as e:
+                if 'BUSYGROUP' not in str(e):
+                    raise
+
+    heartbeat = ListQueue.heartbeat
+
+    def _read(self, count, block=None):
+        """Lê entradas novas esvaziando os streams na ordem de prioridade
+
+        Com `block`, espera por uma entrada de qualquer um deles.
+        """
+        if block is not None:
+            # COUNT vale por stream: pede uma de cada e o resto vem na ordem de prioridade
+            response = self.redis.xreadgroup(self.group, self.consumer,
+                                             {stream: '>' for stream in self.streams},
+                                             count=1, block=block)
+            entries = {}
+            for stream, items in response or []:
+                stream = stream.decode() if isinstance(stream, bytes) else stream
+                entries[stream] = _entries(stream, items)
+            batch = [entry for stream in self.streams for entry in entries.get(stream, [])]
+            if len(batch) > count:
+                self._requeue(batch[count:])
+            return batch[:count]
+
+        batch = []
+        for stream in self.streams:
+            if len(batch) >= count:
+                break
+            response = self.redis.xreadgroup(self.group, self.consumer, {stream: '>'},
+                                             count=count - len(batch))
+            if response:
+                batch.extend(_entries(stream, response[0][1]))
+        return batch
+
+    def fetch(self, max_size, linger=0, timeout=5):
+        """Lê até `max_size` entradas novas, bloqueando até `timeout` pela primeira"""
+        self.heartbeat()
+        batch = self._read(max_size)
+        if not batch and self.migrate():
+            batch = self._read(max_size)
+        if not batch:
+            batch = self._read(max_size, block=int(timeout * 1000))
+        if not batch:
+            return []
+
+        deadline = time.monotonic() + linger
+        while len(batch) < max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            items = self._read(max_size - len(batch))
+            batch.extend(items)
+            if not items:
+                time.sleep(min(0.01, remaining))
+        return batch
+
+    def ack(self, ids):
+        for stream, entry_ids in _by_stream(ids):
+            self.redis.xack(stream, self.group, *entry_ids)
+
+    def _requeue(self, entries):
+        pipe = self.redis.pipeline(transaction=True)
+        for (stream, _), raw in entries:
+            pipe.xadd(stream, {'payload': raw}, maxlen=STREAM_MAXLEN, approximate=True)
+        for stream, entry_ids in _by_stream(entry_id for entry_id, _ in entries):
+            pipe.xack(stream, self.group, *entry_ids)
+        pipe.execute()
+        return len(entries)
+
+    def nack(self, entries):
+        """Reescreve as entradas no fim do seu stream e confirma as originais"""
+        if not entries:
+            return 0
+        return self._requeue(entries)
+
+    def _pending_of(self, stream, consumer, count=1000):
+        pending = self.redis.xpending_range(stream, self.group, min='-', max='+',
+                                            count=count, consumername=consumer)
+        return [p['message_id'] for p in pending]
+
+    def _claim(self, stream, ids):
+        return _entries(stream, self.redis.xclaim(stream, self.group, self.consumer,
+                                                  min_idle_time=0, message_ids=ids))
+
+    def migrate(self):
+        """Move para os streams tudo que produtores antigos colocaram nas listas `sender`
+
+        Roda no reap e sempre que os streams estão vazios no fetch; cada lista
+        é esvaziada em lotes de MIGRATE_BATCH até não sobrar nada.
+        """
+        total = 0
+        for priority in PRIORITIES:
+            stream = lane_key(priority, STREAM_KEY)
+            if stream not in self.streams:
+                continue
+            migrated = 0
+            while True:
+                moved = self._migrate(keys=[lane_key(priority), stream], args=[MIGRATE_BATCH, STREAM_MAXLEN])
+                migrated += moved
+                if moved < MIGRATE_BATCH:
+                    break
+            if migrated:
+                logger.info(f"🔀 {migrated} mensagem(ns) da lista '{lane_key(priority)}' migrada(s) para o stream")
+            total += migrated
+        return total
+
+    def reap(self, force=False):
+        """Devolve aos streams o que consumidores sem heartbeat deixaram pendente
+
+        Também migra para os streams as mensagens que produtores antigos ainda
+        colocam nas listas `sender`.
+        """
+        now = time.monotonic()
+        if not force and now < self._next_reap:
+            return 0
+        self._next_reap = now + REAP_INTERVAL
+
+        self.migrate()
+
+        recovered = 0
+        for stream in self.streams:
+            for info in self.redis.xinfo_consumers(stream, self.group):
+                name = info['name'].decode() if isinstance(info['name'], bytes) else info['name']
+                if name == self.consumer or self.redis.exists(HEARTBEAT_PREFIX + name):
+                    continue
+                while True:
+                    ids = self._pending_of(stream, name)
+                    if not ids:
+                        break
+                    claimed = self._claim(stream, ids)
+                    gone = set(ids) - {entry_id for (_, entry_id), _ in claimed}
+                    if gone:
+                        # Entradas cortadas pelo MAXLEN: não há o que reenviar
+                        self.redis.xack(stream, self.group, *gone)
+                    if claimed:
+                        recovered += self._requeue(claimed)
+                self.redis.xgroup_delconsumer(stream, self.group, name)
+                self.redis.srem(CONSUMERS_KEY, name)
+                logger.warning(f"♻️ Pendências do consumidor {name} devolvidas ao stream {stream}")
+        return recovered
+
+    def close(self):
+        """Devolve aos streams o que ainda estiver pendente e sai do grupo"""
+        for stream in self.streams:
+            ids = self._pending_of(stream, self.consumer)
+            if ids:
+                claimed = self._claim(stream, ids)
+                if claimed:
+                    self._requeue(claimed)
+            self.redis.xgroup_delconsumer(stream, self.group, self.consumer)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.delete(self.heartbeat_key)
+        pipe.srem(CONSUMERS_KEY, self.consumer)
+        pipe.execute()
+
+    def replay(self, start, end='+', count=1000, stream=STREAM_KEY):
+        """Reenfileira entradas antigas do stream (ex.: após um incidente no provedor)"""
+        entries = _entries(stream, self.redis.xrange(stream, min=start, max=end, count=count))
+        pipe = self.redis.pipeline(transaction=False)
+        for _, raw in entries:
+            pipe.xadd(stream, {'payload': raw}, maxlen=STREAM_MAXLEN, approximate=True)
+        pipe.execute()
+        return len(entries)
+
+    def info(self):
+        """Mensagens aguardando em cada stream (o atraso do grupo) e pendências por consumidor
+
+        `depth` tem o mesmo sentido da ListQueue: o que ainda não foi entregue
+        a nenhum consumidor, sem o histórico guardado até STREAM_MAXLEN.
+        """
+        lanes = {}
+        consumers = {}
+        for stream in self.streams:
+            lag, pending = _group_lag(self.redis, stream, self.group)
+            lanes[stream] = {'depth': lag, 'pending': pending}
+            for info in self.redis.xinfo_consumers(stream, self.group):
+                name = info['name'].decode() if isinstance(info['name'], bytes) else info['name']
+                consumer = consumers.setdefault(name, {'pending': 0, 'idle_ms': info['idle']})
+                consumer['pending'] += info['pending']
+                consumer['idle_ms'] = min(consumer['idle_ms'], info['idle'])
+        return {
+            'transport': 'stream',
+            'depth': sum(lane['depth'] for lane in lanes.values()),
+            'lanes': lanes,
+            'consumers': consumers,
+        }
+
+
+def open_queue(redis_conn, consumer=None):
+    """Cria o consumidor do transporte configurado em QUEUE_TRANSPORT"""
+    if QUEUE_TRANSPORT == 'stream':
+        return StreamQueue(redis_conn, consumer)
+    return ListQueue(redis_conn, consumer)
+
+
+def lane_depths(redis_conn, transport=QUEUE_TRANSPORT):
+    """Mensagens aguardando em cada prioridade: LLEN das listas ou o atraso do grupo nos streams"""
+    if transport == 'stream':
+        depths = {}
+        for priority in PRIORITIES:
+            depths[priority] = _group_lag(redis_conn, lane_key(priority, STREAM_KEY))[0]
+        return depths
+    pipe = redis_conn.pipeline(transaction=False)
+    for priority in PRIORITIES:
+        pipe.llen(lane_key(priority))
+    return dict(zip(PRIORITIES, pipe.execute()))
+
+
+class Producer:
+    """Lado produtor da fila: RPUSH na lista ou XADD no stream"""
+
+    def __init__(self, redis_conn, transport=QUEUE_TRANSPORT):
+        self.redis = redis_conn
+        self.transport = transport
+
+    def push(self, payloads, chunk_size=1000, priorities=None, send_at=None):
+        """Enfileira as mensagens em um único round trip; retorna o tamanho da fila
+
+        `priorities` é a prioridade de cada mensagem (todas `normal` se omitido);
+        com mais de uma, o tamanho retornado é o da última fila usada. As que
+        têm um horário futuro em `send_at` (datetime UTC sem fuso) vão para o
+        sorted set de agendadas e entram na fila quando ele chegar (schedule.py).
+        """
+        lanes = {}
+        scheduled = {}
+        now = datetime.utcnow()
+        for payload, priority, when in zip(payloads, priorities or [PRIORITY_DEFAULT] * len(payloads),
+                                           send_at or [None] * len(payloads)):
+            if when is None or when <= now:
+                lanes.setdefault(priority, []).append(payload)
+            else:
+                scheduled.setdefault(priority, {})[payload] = when.replace(tzinfo=timezone.utc).timestamp()
+
+        pipe = self.redis.pipeline(transaction=False)
+        for priority, entries in scheduled.items():
+            pipe.zadd(lane_key(priority, SCHEDULED_KEY), entries)
+        for priority, lane in lanes.items():
+            if self.transport == 'stream':
+                stream = lane_key(priority, STREAM_KEY)
+                for payload in lane:
+                    pipe.xadd(stream, {'payload': payload}, maxlen=STREAM_MAXLEN, approximate=True)
+                pipe.xlen(stream)
+            else:
+                for start in range(0, len(lane), chunk_size):
+                    pipe.rpush(lane_key(priority), *lane[start:start + chunk_size])
+        return pipe.execute()[-1]
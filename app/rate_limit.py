@@ -0,0 +1,136 @@
+"""Limite de envio distribuído (token bucket no Redis, atômico via Lua)
+
+Todos os workers (e o WorkerThread) consultam o mesmo bucket antes de
+chamar o provedor, então a soma das réplicas respeita a cota contratada.
+As regras vêm de RATE_LIMITS, uma por domínio remetente:
+
+    RATE_LIMITS="default=2/s;davi64lima.shop=10/s:20,3000/d"
+
+- `N/s`, `N/m` ou `N/h`: chamadas ao provedor por período (token bucket);
+  `:B` opcional define o burst (padrão: o equivalente a 1 segundo, mínimo 1)
+- `N/d`: e-mails por dia (UTC)
+
+Domínios sem regra própria usam `default`; sem RATE_LIMITS não há limite.
+"""
+import os
+import time
+import random
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'ratelimit:'
+
+# Retorna {1, 0} se liberou, {0, ms} se falta token e {-1, ms} se a cota
+# diária acabou (ms = espera sugerida). O relógio é o do Redis para que
+# todos os workers concordem.
+ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local daily = tonumber(ARGV[4])
+local emails = tonumber(ARGV[5])
+
+if daily > 0 then
+    local used = tonumber(redis.call('GET', KEYS[2]) or '0')
+    if used + emails > daily then
+        return {-1, (86400 - math.floor(now) % 86400) * 1000}
+    end
+end
+
+if rate > 0 then
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    if tokens < cost then
+        return {0, math.ceil((cost - tokens) / rate * 1000)}
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - cost), 'ts', tostring(now))
+    redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+end
+
+if daily > 0 then
+    redis.call('INCRBY', KEYS[2], emails)
+    redis.call('EXPIRE', KEYS[2], 90000)
+end
+return {1, 0}
+"""
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600}
+
+
+class RateLimitExceeded(Exception):
+    """O pedido nunca cabe na cota configurada"""
+
+
+def parse_rules(spec):
+    """Converte RATE_LIMITS em {domínio: {'rate', 'burst', 'daily'}}"""
+    rules = {}
+    for item in filter(None, (part.strip() for part in (spec or '').split(';'))):
+        domain, _, limits = item.partition('=')
+        rule = {'rate': 0.0, 'burst': 0.0, 'daily': 0}
+        for limit in filter(None, (part.strip() for part in limits.split(','))):
+            amount, _, period = limit.partition('/')
+            period, _, burst = period.partition(':')
+            if period == 'd':
+                rule['daily'] = int(amount)
+            elif period in PERIODS:
+                rule['rate'] = float(amount) / PERIODS[period]
+                rule['burst'] = float(burst) if burst else max(1.0, rule['rate'])
+            else:
+                raise ValueError(f"Limite inválido em RATE_LIMITS: {limit!r}")
+        rules[domain.strip().lower()] = rule
+    return rules
+
+
+class RateLimiter:
+    """Token bucket compartilhado por todos os workers"""
+
+    def __init__(self, redis_conn, rules):
+        self.redis = redis_conn
+        self.rules = rules
+        self._acquire = redis_conn.register_script(ACQUIRE_SCRIPT)
+
+    @classmethod
+    def from_env(cls, redis_conn):
+        return cls(redis_conn, parse_rules(os.getenv('RATE_LIMITS', '')))
+
+    def rule_for(self, domain):
+        return self.rules.get(domain.lower(), self.rules.get('default'))
+
+    def acquire(self, from_email, emails=1, calls=1, max_wait=None):
+        """Bloqueia até haver cota para `calls` chamadas levando `emails` e-mails
+
+        Retorna o tempo esperado em segundos. Com `max_wait`, levanta
+        RateLimitExceeded se a espera passar desse limite.
+        """
+        domain = from_email.rsplit('@', 1)[-1]
+        rule = self.rule_for(domain)
+        if not rule:
+            return 0.0
+        if rule['daily'] and emails > rule['daily']:
+            raise RateLimitExceeded(f"{emails} e-mails excedem a cota diária de {domain} ({rule['daily']})")
+        if rule['rate'] and calls > rule['burst']:
+            raise RateLimitExceeded(f"{calls} chamadas excedem o burst de {domain} ({rule['burst']:g})")
+
+        args = [rule['rate'], rule['burst'], calls, rule['daily'], emails]
+        waited = 0.0
+        while True:
+            day = datetime.utcnow().strftime('%Y%m%d')
+            keys = [f"{KEY_PREFIX}{domain}:bucket", f"{KEY_PREFIX}{domain}:day:{day}"]
+            granted, wait_ms = self._acquire(keys=keys, args=args)
+            if granted == 1:
+                return waited
+            # Jitter evita que todos os workers acordem no mesmo instante
+            delay = wait_ms / 1000 * (1 + random.random() * 0.1)
+            if max_wait is not None and waited + delay > max_wait:
+                raise RateLimitExceeded(f"Cota de {domain} esgotada (espera de {delay:.1f}s)")
+            if granted == -1:
+                logger.warning(f"⛔ Cota diária de {domain} esgotada, aguardando {delay:.0f}s")
+                delay = min(delay, 60)  # reavalia a cada minuto (a data muda na chave)
+            time.sleep(delay)
+            waited += delay
@@ -0,0 +1,124 @@
+"""Novas tentativas com backoff exponencial e fila de mensagens mortas
+
+Um envio que falhou não bloqueia o worker: a mensagem vai para o sorted set
+`sender:retry` com score = horário da próxima tentativa e a contagem em
+`tentativas`. Os workers promovem periodicamente as que venceram de volta
+para a fila principal. Depois de RETRY_MAX_ATTEMPTS tentativas, ou em erros
+permanentes (4xx do provedor, exceto 429), a mensagem vai para a lista
+`sender:dead` com o último erro.
+
+Cada prioridade tem o seu sorted set (`sender:retry`, `sender:retry:alta`...),
+e a mensagem volta para a fila da mesma prioridade.
+"""
+import os
+import json
+import time
+import random
+import logging
+
+from queues import QUEUE_KEY, STREAM_KEY, STREAM_MAXLEN, PRIORITIES, lane_key, message_priority
+from codec import encode
+
+logger = logging.getLogger(__name__)
+
+RETRY_KEY = 'sender:retry'
+DEAD_KEY = 'sender:dead'
+
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', 5))
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', 5))
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', 3600))
+# Intervalo (s) entre as promoções de mensagens vencidas
+RETRY_POLL_INTERVAL = float(os.getenv('RETRY_POLL_INTERVAL', 1))
+
+# Move até ARGV[2] mensagens vencidas (score <= ARGV[1]) para a fila principal.
+# ARGV[3] = 'list' (RPUSH) ou 'stream' (XADD com MAXLEN ~ ARGV[4])
+PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #due == 0 then
+    return 0
+end
+redis.call('ZREM', KEYS[1], unpack(due))
+if ARGV[3] == 'stream' then
+    for i = 1, #due do
+        redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[4], '*', 'payload', due[i])
+    end
+else
+    redis.call('RPUSH', KEYS[2], unpack(due))
+end
+return #due
+"""
+
+
+def backoff(attempt):
+    """Atraso (s) antes da tentativa `attempt` + 1: exponencial com jitter"""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return random.uniform(delay / 2, delay)
+
+
+def is_permanent(error):
+    """Erros 4xx do provedor (exceto 429) e recusas 5xx do SMTP não adiantam repetir"""
+    if getattr(error, 'permanent', None) is not None:
+        return error.permanent
+    try:
+        code = int(getattr(error, 'code', 0) or 0)
+    except (TypeError, ValueError):
+        return False
+    return 400 <= code < 500 and code != 429
+
+
+class RetryScheduler:
+    """Agenda novas tentativas no sorted set e promove as que venceram"""
+
+    def __init__(self, redis_conn, transport='list', max_attempts=RETRY_MAX_ATTEMPTS):
+        self.redis = redis_conn
+        self.transport = transport
+        self.target = STREAM_KEY if transport == 'stream' else QUEUE_KEY
+        # (sorted set, fila de destino) de cada prioridade
+        self.lanes = [(lane_key(priority, RETRY_KEY), lane_key(priority, self.target)) for priority in PRIORITIES]
+        self.max_attempts = max_attempts
+        self._promote = redis_conn.register_script(PROMOTE_SCRIPT)
+        self._next_promote = 0
+
+    def schedule(self, mensagens, error):
+        """Agenda as mensagens que falharam; retorna as listas (reagendadas, mortas)"""
+        now = time.time()
+        permanent = is_permanent(error)
+        retried = []
+        dead = []
+        pipe = self.redis.pipeline(transaction=False)
+        for mensagem in mensagens:
+            attempt = int(mensagem.get('tentativas', 0)) + 1
+            mensagem = dict(mensagem, tentativas=attempt)
+            if permanent or attempt >= self.max_attempts:
+                mensagem.update(erro=str(error), falhou_em=now)
+                # A fila de mortas fica sempre em JSON, para ser lida por pessoas
+                pipe.rpush(DEAD_KEY, json.dumps(mensagem))
+                dead.append(mensagem)
+            else:
+                pipe.zadd(lane_key(message_priority(mensagem), RETRY_KEY), {encode(mensagem): now + backoff(attempt)})
+                retried.append(mensagem)
+        pipe.execute()
+        return retried, dead
+
+    def promote(self, force=False, limit=1000):
+        """Devolve à fila principal as tentativas cujo horário chegou"""
+        now = time.monotonic()
+        if not force and now < self._next_promote:
+            return 0
+        self._next_promote = now + RETRY_POLL_INTERVAL
+
+        promoted = 0
+        for retry_key, target in self.lanes:
+            promoted += self._promote(keys=[retry_key, target],
+                                      args=[time.time(), limit, self.transport, STREAM_MAXLEN])
+        if promoted:
+            logger.info(f"🔁 {promoted} mensagem(ns) voltaram para a fila para nova tentativa")
+        return promoted
+
+    def info(self):
+        pipe = self.redis.pipeline(transaction=False)
+        for retry_key, _ in self.lanes:
+            pipe.zcard(retry_key)
+        pipe.llen(DEAD_KEY)
+        *retry, dead = pipe.execute()
+        return {'retry': sum(retry), 'dead': dead}
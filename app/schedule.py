@@ -0,0 +1,84 @@
+"""Envio agendado
+
+Uma mensagem com `enviar_em` no futuro não entra na fila: fica no sorted set
+`sender:agendadas` da sua prioridade com score = horário do envio. Os workers
+promovem periodicamente as que venceram para a fila, em lotes de
+SCHEDULE_BATCH_SIZE com um script Lua atômico. O ZRANGEBYSCORE limitado só
+toca nas mensagens vencidas (O(log N) + lote), então milhões de agendadas
+não custam nada a cada varredura.
+"""
+import os
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+
+from queues import QUEUE_KEY, STREAM_KEY, STREAM_MAXLEN, SCHEDULED_KEY, PRIORITIES, lane_key
+from retry import PROMOTE_SCRIPT
+
+logger = logging.getLogger(__name__)
+
+SCHEDULED = 'agendada'
+# Intervalo (s) entre as promoções; é também a precisão do horário de envio
+SCHEDULE_POLL_INTERVAL = float(os.getenv('SCHEDULE_POLL_INTERVAL', 1))
+SCHEDULE_BATCH_SIZE = int(os.getenv('SCHEDULE_BATCH_SIZE', 1000))
+SCHEDULE_MAX_DAYS = int(os.getenv('SCHEDULE_MAX_DAYS', 365))
+
+
+def parse_send_at(value):
+    """Lê `enviar_em` (ISO 8601, sem fuso = UTC); levanta ValueError se inválido
+
+    Retorna um datetime UTC sem fuso, como a coluna `data`, ou None se o
+    horário já passou (a mensagem vai direto para a fila).
+    """
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    when = datetime.fromisoformat(value)
+    if when.tzinfo is not None:
+        when = when.astimezone(timezone.utc).replace(tzinfo=None)
+    now = datetime.utcnow()
+    if when - now > timedelta(days=SCHEDULE_MAX_DAYS):
+        raise ValueError(f"enviar_em deve estar a no máximo {SCHEDULE_MAX_DAYS} dias")
+    return when if when > now else None
+
+
+class Scheduler:
+    """Promove as mensagens agendadas que venceram para a fila da sua prioridade"""
+
+    def __init__(self, redis_conn, transport='list', batch_size=SCHEDULE_BATCH_SIZE):
+        self.redis = redis_conn
+        self.transport = transport
+        self.batch_size = batch_size
+        target = STREAM_KEY if transport == 'stream' else QUEUE_KEY
+        # (sorted set, fila de destino), da maior prioridade para a menor
+        self.lanes = [(lane_key(priority, SCHEDULED_KEY), lane_key(priority, target)) for priority in PRIORITIES]
+        self._promote = redis_conn.register_script(PROMOTE_SCRIPT)
+        self._next_promote = 0
+
+    def promote(self, force=False):
+        """Move para as filas tudo que venceu, um lote por chamada ao Redis"""
+        now = time.monotonic()
+        if not force and now < self._next_promote:
+            return 0
+        self._next_promote = now + SCHEDULE_POLL_INTERVAL
+
+        promoted = 0
+        for key, target in self.lanes:
+            while True:
+                moved = self._promote(keys=[key, target],
+                                      args=[time.time(), self.batch_size, self.transport, STREAM_MAXLEN])
+                promoted += moved
+                if moved < self.batch_size:
+                    break
+        if promoted:
+            logger.info(f"⏰ {promoted} mensagem(ns) agendada(s) entraram na fila")
+        return promoted
+
+    def info(self):
+        """Quantas estão agendadas e o horário (epoch) da próxima"""
+        pipe = self.redis.pipeline(transaction=False)
+        for key, _ in self.lanes:
+            pipe.zcard(key)
+            pipe.zrange(key, 0, 0, withscores=True)
+        results = pipe.execute()
+        first = [entries[0][1] for entries in results[1::2] if entries]
+        return {'scheduled': sum(results[::2]), 'next_scheduled': min(first, default=None)}
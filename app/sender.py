@@ -1,25 +1,103 @@
 import os 
-import psycopg2
 import redis
 import json
 import logging
 import sys
-from bottle import Bottle, request, response, hook
+import time
+import psycopg2
+from bottle import Bottle, HTTPResponse, request, response, hook
 from datetime import datetime
+from psycopg2.extras import execute_values, Json
+from db_pool import PostgresPool, dsn_from_env
+from queues import Producer, open_queue, PRIORITIES, PRIORITY_DEFAULT
+from retry import RetryScheduler
+from health import HealthMonitor
+from outbox import PENDING, QUEUED, OUTBOX_CHANNEL, build_payload
+from validation import length_error
+from queries import parse_filters, get_email, stream_emails
+from bodies import body_hash, should_offload, store_bodies
+from idempotency import IdempotencyCache, request_key
+from schedule import SCHEDULED, Scheduler, parse_send_at
+from logs import setup_logging, debug_sampled
+from metrics import REGISTRY, CONTENT_TYPE, register_queue_gauges
+from templates import TEMPLATE_MAX_LENGTH
 
-# Configurar logging estruturado
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.StreamHandler(sys.stderr)
-    ]
-)
+# Logs escritos por uma thread em segundo plano (ver logs.py)
+setup_logging('sender')
 logger = logging.getLogger(__name__)
 
+REQUIRED_FIELDS = ('assunto', 'mensagem', 'email')
+BULK_MAX_ROWS = int(os.getenv('BULK_MAX_ROWS', 50000))
+BULK_PAGE_SIZE = int(os.getenv('BULK_PAGE_SIZE', 1000))
+# Lotes (newsletters) vão para uma fila de menor prioridade que as mensagens avulsas
+BULK_PRIORITY = os.getenv('BULK_PRIORITY', 'baixa')
+
+REQUESTS = REGISTRY.counter('sender_http_requests_total', 'Requisições atendidas pela API',
+                            ('route', 'method', 'status'))
+REQUEST_LATENCY = REGISTRY.histogram('sender_http_request_duration_seconds', 'Duração das requisições da API',
+                                     ('route', 'method'))
+DB_LATENCY = REGISTRY.histogram('sender_db_duration_seconds', 'Duração das operações no Postgres', ('operation',))
+REDIS_LATENCY = REGISTRY.histogram('sender_redis_duration_seconds', 'Duração das operações no Redis', ('operation',))
+
+
+class RequestMetrics:
+    """Plugin do Bottle que mede cada rota; o label é a regra (`/api/emails/<msg_id:int>`), não a URL"""
+
+    name = 'metrics'
+    api = 2
+
+    def apply(self, callback, route):
+        labels = (route.rule, route.method)
+
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            status = 500
+            try:
+                body = callback(*args, **kwargs)
+                status = response.status_code
+                return body
+            except HTTPResponse as e:
+                status = e.status_code
+                raise
+            finally:
+                REQUEST_LATENCY.observe(time.perf_counter() - started, labels)
+                REQUESTS.inc(labels + (status,))
+
+        return wrapper
+
+
+def validate_row(row):
+    """Retorna o erro de uma linha do lote, ou None se ela for válida
+
+    Uma linha pode trazer `template` (id) e `variaveis` no lugar de assunto e
+    mensagem, a `prioridade` (BULK_PRIORITY se omitida) e `enviar_em`.
+    """
+    if not isinstance(row, dict):
+        return "Linha deve ser um objeto JSON"
+    if row.get('prioridade', BULK_PRIORITY) not in PRIORITIES:
+        return f"prioridade deve ser uma de {list(PRIORITIES)}"
+    if 'enviar_em' in row:
+        if not isinstance(row['enviar_em'], str):
+            return "enviar_em deve ser uma data ISO 8601"
+        try:
+            parse_send_at(row['enviar_em'])
+        except ValueError as e:
+            return f"enviar_em inválido: {e}"
+    required = REQUIRED_FIELDS
+    if 'template' in row:
+        if not isinstance(row['template'], int) or isinstance(row['template'], bool):
+            return "template deve ser o id (inteiro) de um template"
+        if not isinstance(row.get('variaveis', {}), dict):
+            return "variaveis deve ser um objeto JSON"
+        required = ('email',)
+    missing = [field for field in required
+               if not isinstance(row.get(field), str) or not row[field].strip()]
+    if missing:
+        return f"Campos obrigatórios ausentes ou vazios: {missing}"
+    return length_error(row)
+
 class Sender(Bottle):
-    def __init__(self):
+    def __init__(self, start=True):
         super().__init__()
         logger.info("=== Starting Sender Application ===")
         logger.info(f"DB_NAME: {os.getenv('DB_NAME')}")
@@ -28,10 +106,49 @@ class Sender(Bottle):
         logger.info(f"DB_HOST: {os.getenv('DB_HOST')}")
         logger.info(f"REDIS_HOST: {os.getenv('REDIS_HOST')}")
 
-        self.dsn = f"dbname={os.getenv('DB_NAME', 'email_sender')} " \
-                   f"user={os.getenv('DB_USER', 'postgres')} " \
-                   f"password={os.getenv('DB_PASS', 'postgres')} " \
-                   f"host={os.getenv('DB_HOST', 'db')}"
+        # Resolvido uma vez na inicialização, não a cada requisição
+        self.redis_disabled = os.getenv('REDIS_DISABLED', 'false').lower() == 'true'
+        if self.redis_disabled:
+            logger.info("[REDIS] Redis disabled via REDIS_DISABLED=true")
+        # Outbox: a requisição só grava no Postgres; o relay (outbox.py) enfileira
+        self.outbox = os.getenv('OUTBOX', 'false').lower() == 'true'
+        if self.outbox:
+            logger.info("[OUTBOX] Outbox mode enabled, run outbox.py to relay messages")
+
+        self.dsn = dsn_from_env()
+        self.read_dsn = dsn_from_env(os.getenv('DB_READ_HOST'))
+        self.init_clients()
+        if start:
+            self.start()
+
+        # Rotas
+        self.route('/api', method='POST', callback=self.send)
+        self.route('/api/bulk', method='POST', callback=self.send_bulk)
+        self.route('/', method='GET', callback=self.index)
+        self.route('/api/pool', method='GET', callback=self.pool_stats)
+        self.route('/api/queue', method='GET', callback=self.queue_stats)
+        self.route('/api/health', method='GET', callback=self.health)
+        self.route('/api/emails', method='GET', callback=self.list_emails)
+        self.route('/api/emails/<msg_id:int>', method='GET', callback=self.get_email)
+        self.route('/api/templates', method='POST', callback=self.create_template)
+        self.route('/api/templates/<template_id:int>', method='GET', callback=self.get_template)
+        self.route('/metrics', method='GET', callback=self.metrics)
+        # Preflight do navegador, necessário por causa do cabeçalho Idempotency-Key
+        self.route('/<path:path>', method='OPTIONS', callback=self.preflight)
+        self.add_hook('after_request', self.enable_cors)
+        self.install(RequestMetrics())
+        logger.info("=== Sender Application initialized successfully ===")
+
+    def init_clients(self):
+        """Cria o pool do Postgres, o cliente Redis e o monitor, sem abrir conexões
+
+        Com o gunicorn em preload_app isto roda no master: as conexões e a
+        thread do monitor só nascem no start(), já dentro de cada processo.
+        """
+        self.pool = PostgresPool.from_env(self.dsn)
+        # Pool separado (e opcionalmente em uma réplica) para as consultas, que
+        # assim nunca ocupam as conexões usadas pelos INSERTs
+        self.read_pool = PostgresPool(self.read_dsn, minconn=0, maxconn=int(os.getenv('DB_READ_POOL_MAX', 4)))
 
         redis_host = os.getenv('REDIS_HOST', 'queue') 
         redis_password = os.getenv('REDIS_PASSWORD')
@@ -44,102 +161,478 @@ class Sender(Bottle):
             socket_timeout=5,
             retry_on_timeout=True
         )
+        self.producer = Producer(self.fila)
+        self.idempotency = IdempotencyCache(self.fila)
 
-        # Rotas
-        self.route('/api', method='POST', callback=self.send)
-        self.route('/', method='GET', callback=self.index)
-        self.add_hook('after_request', self.enable_cors)
-        logger.info("=== Sender Application initialized successfully ===")
+        # O PING fica com o monitor em segundo plano; a requisição só olha o breaker
+        checks = {'postgres': self.check_postgres}
+        if not self.redis_disabled:
+            checks['redis'] = self.fila.ping
+        self.monitor = HealthMonitor(checks)
+
+        REGISTRY.gauge('sender_db_pool_connections', 'Conexões do pool de escrita do Postgres',
+                       lambda: {(state,): self.pool.stats()[state] for state in ('in_use', 'idle', 'waiting')},
+                       ('state',), per_process=True)
+        if not self.redis_disabled:
+            register_queue_gauges(self.fila, self.producer.transport)
+
+    def start(self):
+        """Abre as conexões iniciais e sobe o monitor (post_worker_init no gunicorn)"""
+        try:
+            # As primeiras requisições não pagam a abertura das conexões
+            self.pool.warm()
+        except Exception as e:
+            logger.warning("[POOL] Could not open initial connections: %s", e)
+        self.monitor.start()
+
+    def check_postgres(self):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
 
     def index(self):
         logger.info("Health check endpoint accessed")
         return "To rodando papai!!"
 
+    def pool_stats(self):
+        return self.pool.stats()
+
+    def queue_stats(self):
+        info = open_queue(self.fila, consumer='api').info()
+        info.update(RetryScheduler(self.fila).info())
+        info.update(Scheduler(self.fila).info())
+        return info
+
+    def metrics(self):
+        response.content_type = CONTENT_TYPE
+        return REGISTRY.render()
+
+    def health(self):
+        status = self.monitor.status()
+        if any(check['state'] == 'open' for check in status.values()):
+            response.status = 503
+        return status
+
+    def get_email(self, msg_id):
+        email = get_email(self.read_pool, msg_id)
+        if email is None:
+            response.status = 404
+            return {'erro': f"Mensagem {msg_id} não encontrada"}
+        return email
+
+    def list_emails(self):
+        try:
+            where, args, limit = parse_filters(request.query)
+        except ValueError as e:
+            response.status = 400
+            return {'erro': str(e)}
+        try:
+            page = stream_emails(self.read_pool, where, args, limit)
+        except Exception as e:
+            logger.error("[DB ERROR] Could not list emails: %s", e)
+            response.status = 500
+            return {'erro': str(e)}
+        response.content_type = 'application/json'
+        return page
+
+    def preflight(self, path):
+        return ''
+
     def enable_cors(self):
         # Permitir origem do frontend
         response.headers['Access-Control-Allow-Origin'] = '*'
         response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Origin, Accept, Content-Type, X-Requested-With'
+        response.headers['Access-Control-Allow-Headers'] = 'Origin, Accept, Content-Type, X-Requested-With, Idempotency-Key'
+
+    def claim_request(self, route, fields=None):
+        """Reserva a requisição pelo Idempotency-Key ou, sem ele, pelo hash de `fields`
+
+        Retorna (chave, ttl, resultado anterior). Sem Redis a requisição
+        segue sem deduplicação em vez de falhar.
+        """
+        breaker = self.monitor.breakers.get('redis')
+        if breaker is None or not breaker.allow():
+            return None, 0, None
+        key, ttl = request_key(route, request.get_header('Idempotency-Key'), fields)
+        if key is None:
+            return None, 0, None
+        try:
+            with REDIS_LATENCY.time(('idempotency',)):
+                previous = self.idempotency.claim(key, ttl)
+            breaker.record_success()
+        except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as e:
+            breaker.record_failure(e)
+            logger.error("[IDEMPOTENCY] Could not claim request, continuing without dedup: %s", e)
+            return None, 0, None
+        except Exception as e:
+            # Erro do comando, não do Redis: não conta para o circuito
+            logger.error("[IDEMPOTENCY] Could not claim request, continuing without dedup: %s", e)
+            return None, 0, None
+        return key, ttl, previous
+
+    def replay(self, previous, in_progress):
+        """Resposta para uma requisição repetida: o resultado original, ou 409 se ainda em andamento"""
+        if not previous:
+            response.status = 409
+            logger.warning("[IDEMPOTENCY] Request still in progress")
+            return in_progress
+        logger.info("[IDEMPOTENCY] Replaying stored response")
+        response.status = previous['status']
+        response.set_header('Idempotent-Replayed', 'true')
+        return previous['body']
+
+    def finish_request(self, key, ttl, body):
+        """Guarda o resultado para as repetições; erros do servidor liberam a chave"""
+        if key is None:
+            return
+        try:
+            if response.status_code >= 500:
+                self.idempotency.release(key)
+            else:
+                self.idempotency.complete(key, ttl, response.status_code, body)
+        except Exception as e:
+            logger.error("[IDEMPOTENCY] Could not store response: %s", e)
 
-    def register_message(self, assunto, mensagem, email):
-        SQL = 'INSERT INTO emails (data, assunto, mensagem, email) VALUES (%s, %s, %s, %s)'
+    def queue_directly(self):
+        """Enfileirar agora? Não no modo outbox, sem Redis ou com o circuito aberto"""
+        if self.outbox or self.redis_disabled:
+            return False
+        if not self.monitor.breakers['redis'].allow():
+            logger.warning("[REDIS] Circuit open, leaving message pending in the outbox")
+            return False
+        return True
+
+    def mark_pending(self, ids):
+        """Devolve ao outbox as linhas que não foram enfileiradas"""
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute('UPDATE emails SET status = %s WHERE id = ANY(%s)', (PENDING, ids))
+                conn.commit()
+        except Exception as e:
+            logger.error("[DB ERROR] Could not mark %d message(s) as pending: %s", len(ids), e)
+
+    def register_message(self, assunto, mensagem, email, prioridade=PRIORITY_DEFAULT, enviar_em=None):
+        SQL = 'INSERT INTO emails (data, assunto, mensagem, email, status, corpo_hash, prioridade, agendado_para) ' \
+              'VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id'
         now = datetime.utcnow()
+        queue_now = self.queue_directly()
+        # Corpos grandes vão para a tabela corpos e a fila leva só o hash
+        corpo_hash = body_hash(mensagem) if should_offload(mensagem) else None
+        inline = None if corpo_hash else mensagem
+        status = (SCHEDULED if enviar_em else QUEUED) if queue_now else PENDING
+        params = (now, assunto, inline, email, status, corpo_hash, prioridade, enviar_em)
 
         try:
-            logger.info(f"[DB] Attempting to connect with DSN: {self.dsn}")
-            with psycopg2.connect(self.dsn, connect_timeout=5) as conn:
-                logger.info("[DB] Connection successful!")
+            with DB_LATENCY.time(('insert',)), self.pool.connection() as conn:
                 with conn.cursor() as cur:
-                    cur.execute(SQL, (now, assunto, mensagem, email))
-                    conn.commit()
-                    logger.info("[DB] Insert successful!")
+                    if corpo_hash:
+                        store_bodies(cur, {corpo_hash: mensagem})
+                    if queue_now:
+                        cur.execute(SQL, params)
+                        msg_id = cur.fetchone()[0]
+                    else:
+                        # INSERT e NOTIFY na mesma transação e no mesmo round trip
+                        cur.execute(f'{SQL}; NOTIFY {OUTBOX_CHANNEL}', params)
+                conn.commit()
+                logger.debug("[DB] Insert successful!")
         except Exception as e:
-            logger.error(f"[DB ERROR] {e}")
+            logger.error("[DB ERROR] %s", e)
             raise
 
-        # Check if Redis is disabled via environment variable
-        redis_disabled = os.getenv('REDIS_DISABLED', 'false').lower() == 'true'
-        
-        if redis_disabled:
-            logger.info("[REDIS] Redis disabled via REDIS_DISABLED=true")
-            msg = {'data': now.isoformat(), 'assunto': assunto, 'mensagem': mensagem, 'email': email}
-            logger.info(f"[REDIS] Message would be sent: {json.dumps(msg)}")
+        if not queue_now:
+            logger.debug('[OK] Mensagem registrada no outbox!')
             return
-        
+
+        breaker = self.monitor.breakers['redis']
+        try:
+            payload = build_payload(msg_id, now, assunto, inline, email, corpo_hash=corpo_hash, prioridade=prioridade)
+            with REDIS_LATENCY.time(('push',)):
+                result = self.producer.push([payload], priorities=[prioridade], send_at=[enviar_em])
+            breaker.record_success()
+            logger.debug('[REDIS] Message pushed to queue successfully! Queue length: %s', result)
+        except Exception as e:
+            breaker.record_failure(e)
+            logger.error("[REDIS ERROR] %s", e)
+            logger.warning("[REDIS] Leaving message pending in the outbox")
+            self.mark_pending([msg_id])
+
+    def register_bulk(self, rows):
+        """Grava o lote com um INSERT de várias linhas e enfileira em um único pipeline
+
+        Retorna os ids gerados (na ordem das linhas), se o lote foi enfileirado
+        e o horário de envio de cada linha (None se não foi agendada).
+        """
+        SQL = 'INSERT INTO emails (data, assunto, mensagem, email, status, template_id, variaveis, corpo_hash, ' \
+              'prioridade, agendado_para) VALUES %s RETURNING id'
+        now = datetime.utcnow()
+        queue_now = self.queue_directly()
+        send_at = [parse_send_at(row['enviar_em']) if row.get('enviar_em') else None for row in rows]
+
+        # Uma newsletter repete o mesmo corpo em todas as linhas: calcula o hash uma vez
+        bodies = {}
+        hashes = {}
+        for row in rows:
+            mensagem = row.get('mensagem')
+            if should_offload(mensagem) and mensagem not in hashes:
+                hashes[mensagem] = body_hash(mensagem)
+                bodies[hashes[mensagem]] = mensagem
+        values = [(now, row.get('assunto'), None if row.get('mensagem') in hashes else row.get('mensagem'),
+                   row['email'], (SCHEDULED if when else QUEUED) if queue_now else PENDING, row.get('template'),
+                   Json(row.get('variaveis') or {}) if 'template' in row else None,
+                   hashes.get(row.get('mensagem')), row.get('prioridade', BULK_PRIORITY), when)
+                  for row, when in zip(rows, send_at)]
+
         try:
-            logger.info(f"[REDIS] Attempting to connect to Redis at {self.fila.connection_pool.connection_kwargs}")
-            
-            # Test connection first
-            self.fila.ping()
-            logger.info("[REDIS] Connection test successful!")
-            
-            msg = {'data': now.isoformat(), 'assunto': assunto, 'mensagem': mensagem, 'email': email}
-            msg_json = json.dumps(msg)
-            logger.info(f"[REDIS] Message JSON: {msg_json}")
-            
-            result = self.fila.rpush('sender', msg_json)
-            logger.info(f'[REDIS] Message pushed to queue successfully! Queue length: {result}')
+            with DB_LATENCY.time(('insert_bulk',)), self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    store_bodies(cur, bodies)
+                    ids = [r[0] for r in execute_values(cur, SQL, values,
+                                                        page_size=BULK_PAGE_SIZE, fetch=True)]
+                    if not queue_now:
+                        cur.execute(f'NOTIFY {OUTBOX_CHANNEL}')
+                conn.commit()
+                logger.info("[DB] Bulk insert successful! Rows: %d", len(ids))
+        except Exception as e:
+            logger.error("[DB ERROR] %s", e)
+            raise
+
+        if not queue_now:
+            return ids, False, send_at
+
+        breaker = self.monitor.breakers['redis']
+        payloads = [build_payload(msg_id, now, assunto, mensagem, email, template, row.get('variaveis'), corpo_hash,
+                                  prioridade)
+                    for msg_id, row, (_, assunto, mensagem, email, _, template, _, corpo_hash, prioridade, _)
+                    in zip(ids, rows, values)]
+        try:
+            with REDIS_LATENCY.time(('push_bulk',)):
+                result = self.producer.push(payloads, chunk_size=BULK_PAGE_SIZE,
+                                            priorities=[value[-2] for value in values], send_at=send_at)
+            breaker.record_success()
+            logger.info('[REDIS] Bulk pushed to queue successfully! Queue length: %s', result)
+            return ids, True, send_at
+        except Exception as e:
+            breaker.record_failure(e)
+            logger.error("[REDIS ERROR] %s", e)
+            logger.warning("[REDIS] Leaving bulk pending in the outbox")
+            self.mark_pending(ids)
+            return ids, False, send_at
+
+    def existing_templates(self, template_ids):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('SELECT id FROM templates WHERE id = ANY(%s)', (list(template_ids),))
+                found = {row[0] for row in cur.fetchall()}
+            conn.rollback()
+        return found
+
+    def create_template(self):
+        """Cadastra um template: {"nome", "assunto", "corpo"} com variáveis `$nome`"""
+        try:
+            template = request.json
+        except ValueError as e:
+            response.status = 400
+            return {'erro': f"JSON inválido: {e}"}
+        if not isinstance(template, dict):
+            response.status = 400
+            return {'erro': "Corpo deve ser um objeto JSON"}
+        missing = [field for field in ('nome', 'assunto', 'corpo')
+                   if not isinstance(template.get(field), str) or not template[field].strip()]
+        if missing:
+            response.status = 400
+            return {'erro': f"Campos obrigatórios ausentes ou vazios: {missing}"}
+        error_msg = length_error(template, TEMPLATE_MAX_LENGTH)
+        if error_msg:
+            response.status = 400
+            return {'erro': error_msg}
+
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute('INSERT INTO templates (nome, assunto, corpo) VALUES (%s, %s, %s) RETURNING id',
+                                (template['nome'], template['assunto'], template['corpo']))
+                    template_id = cur.fetchone()[0]
+                conn.commit()
+        except (psycopg2.DataError, ValueError) as e:
+            response.status = 400
+            return {'erro': str(e)}
         except Exception as e:
-            logger.error(f"[REDIS ERROR] {e}")
-            logger.error(f"[REDIS ERROR] Error type: {type(e)}")
-            logger.warning("[REDIS] Continuing without Redis...")
-            # Don't raise the exception, just log it
-            # raise
+            logger.error("[DB ERROR] Could not create template: %s", e)
+            response.status = 500
+            return {'erro': str(e)}
+        logger.info(f"[TEMPLATE] Created template {template_id} ({template['nome']})")
+        response.status = 201
+        return {'id': template_id}
+
+    def get_template(self, template_id):
+        with self.read_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('SELECT id, nome, assunto, corpo, criado_em FROM templates WHERE id = %s',
+                            (template_id,))
+                row = cur.fetchone()
+            conn.rollback()
+        if row is None:
+            response.status = 404
+            return {'erro': f"Template {template_id} não encontrado"}
+        return {'id': row[0], 'nome': row[1], 'assunto': row[2], 'corpo': row[3],
+                'criado_em': row[4].isoformat()}
+
+    def read_bulk_rows(self):
+        """Lê o corpo como array JSON ou NDJSON (um objeto por linha)
+
+        Linhas NDJSON malformadas viram `None` e são reportadas como inválidas.
+        """
+        if 'ndjson' in (request.content_type or ''):
+            rows = []
+            for line in request.body:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    rows.append(None)
+            return rows
+
+        rows = json.load(request.body)
+        if not isinstance(rows, list):
+            raise ValueError("Corpo deve ser um array JSON")
+        return rows
+
+    def send_bulk(self):
+        # Lotes só são deduplicados pelo Idempotency-Key: o hash do corpo custaria uma leitura a mais
+        key, ttl, previous = self.claim_request('api/bulk')
+        if previous is not None:
+            return self.replay(previous, {'erro': "Lote com o mesmo Idempotency-Key ainda em processamento"})
+        body = self.process_bulk()
+        self.finish_request(key, ttl, body)
+        return body
+
+    def process_bulk(self):
+        try:
+            try:
+                rows = self.read_bulk_rows()
+            except ValueError as e:
+                response.status = 400
+                return {'erro': f"JSON inválido: {e}"}
+
+            if len(rows) > BULK_MAX_ROWS:
+                response.status = 413
+                return {'erro': f"Máximo de {BULK_MAX_ROWS} mensagens por lote"}
+
+            logger.info("[REQUEST] Received bulk POST with %d rows", len(rows))
+            results = []
+            valid = []
+            for line, row in enumerate(rows):
+                error = validate_row(row)
+                if error:
+                    results.append({'linha': line, 'status': 'invalida', 'erro': error})
+                else:
+                    results.append(None)
+                    valid.append((line, row))
+
+            # Linhas que apontam para templates inexistentes também são inválidas
+            template_ids = {row['template'] for _, row in valid if 'template' in row}
+            missing = template_ids - self.existing_templates(template_ids) if template_ids else set()
+            if missing:
+                for line, row in valid:
+                    if row.get('template') in missing:
+                        results[line] = {'linha': line, 'status': 'invalida',
+                                         'erro': f"Template {row['template']} não existe"}
+                valid = [(line, row) for line, row in valid if row.get('template') not in missing]
+
+            if not valid:
+                response.status = 400
+                return {'aceitas': 0, 'rejeitadas': len(results), 'resultados': results}
 
-        logger.info('[OK] Mensagem registrada e enfileirada!')
+            ids, queued, send_at = self.register_bulk([row for _, row in valid])
+            for (line, _), msg_id, when in zip(valid, ids, send_at):
+                status = ('agendada' if when else 'enfileirada') if queued else 'registrada'
+                results[line] = {'linha': line, 'id': msg_id, 'status': status}
+
+            logger.info("[SUCCESS] Bulk: %d accepted, %d rejected", len(valid), len(rows) - len(valid))
+            return {'aceitas': len(valid), 'rejeitadas': len(rows) - len(valid), 'resultados': results}
+        except Exception as e:
+            response.status = 500
+            logger.error("[ERRO] %s", e)
+            return {'erro': str(e)}
 
     def send(self):
+        key, ttl = None, 0
         try:
-            logger.info(f"[REQUEST] Received POST to /api")
-            logger.info(f"[REQUEST] Content-Type: {request.content_type}")
-            logger.info(f"[REQUEST] Forms: {dict(request.forms)}")
-            
             assunto = request.forms.get('assunto')
             mensagem = request.forms.get('mensagem')
             email = request.forms.get('email')
+            prioridade = request.forms.get('prioridade') or PRIORITY_DEFAULT
+            enviar_em = request.forms.get('enviar_em')
 
-            logger.info(f"[REQUEST] Extracted - assunto: {assunto}, mensagem: {mensagem}, email: {email}")
+            # O corpo inteiro só aparece em DEBUG e em uma amostra das requisições
+            debug_sampled(logger, "[REQUEST] Content-Type: %s assunto: %s mensagem: %s email: %s",
+                          request.content_type, assunto, mensagem, email)
 
             if not (assunto and mensagem and email):
                 response.status = 400
                 error_msg = "Campos obrigatórios: assunto, mensagem, email."
-                logger.error(f"[ERROR] {error_msg}")
+                logger.error("[ERROR] %s", error_msg)
+                return error_msg
+            error_msg = length_error({'assunto': assunto, 'email': email})
+            if error_msg:
+                response.status = 400
+                logger.error("[ERROR] %s", error_msg)
+                return error_msg
+            if prioridade not in PRIORITIES:
+                response.status = 400
+                error_msg = f"prioridade deve ser uma de: {', '.join(PRIORITIES)}."
+                logger.error("[ERROR] %s", error_msg)
                 return error_msg
+            try:
+                send_at = parse_send_at(enviar_em) if enviar_em else None
+            except ValueError as e:
+                response.status = 400
+                error_msg = f"enviar_em inválido (use ISO 8601, ex.: 2030-01-31T09:00:00-03:00): {e}"
+                logger.error("[ERROR] %s", error_msg)
+                return error_msg
+
+            key, ttl, previous = self.claim_request('api', {'assunto': assunto, 'mensagem': mensagem, 'email': email,
+                                                            'enviar_em': enviar_em})
+            if previous is not None:
+                return self.replay(previous, "Mensagem idêntica ainda em processamento.")
 
-            logger.info(f"[RECEBIDO] assunto={assunto} email={email}")
-            self.register_message(assunto, mensagem, email)
+            logger.info("[RECEBIDO] assunto=%s email=%s prioridade=%s", assunto, email, prioridade)
+            self.register_message(assunto, mensagem, email, prioridade, send_at)
 
-            success_msg = f'Mensagem enfileirada! Assunto: {assunto} Mensagem: {mensagem} Email: {email}'
-            logger.info(f"[SUCCESS] {success_msg}")
+            if send_at:
+                success_msg = f'Mensagem agendada para {send_at.isoformat()} UTC! Assunto: {assunto} ' \
+                              f'Mensagem: {mensagem} Email: {email}'
+            else:
+                success_msg = f'Mensagem enfileirada! Assunto: {assunto} Mensagem: {mensagem} Email: {email}'
+            logger.info("[SUCCESS] Message accepted for %s", email)
+            self.finish_request(key, ttl, success_msg)
             return success_msg
         except Exception as e:
             response.status = 500
-            error_msg = f"[ERRO] {e}"
-            logger.error(error_msg)
+            logger.error("[ERRO] %s", e)
+            self.finish_request(key, ttl, None)
             return str(e)
 
+def create_app():
+    """Fábrica usada pelo gunicorn: `gunicorn -c gunicorn.conf.py 'sender:create_app()'`
+
+    O start() fica para o post_worker_init, já no processo que atende.
+    """
+    return Sender(start=False)
+
 if __name__ == '__main__':
-    logger.info("=== Starting Sender Application ===")
-    sender = Sender()
-    logger.info("Starting Bottle server on 0.0.0.0:8080")
-    sender.run(host='0.0.0.0', port=8080, debug=True)
+    if os.getenv('APP_SERVER', 'dev') == 'gunicorn':
+        # Modo de produção: vários processos pré-forkados (ver gunicorn.conf.py)
+        from gunicorn.app.wsgiapp import run
+        app_dir = os.path.dirname(os.path.abspath(__file__))
+        sys.argv = ['gunicorn', '--chdir', app_dir,
+                    '-c', os.path.join(app_dir, 'gunicorn.conf.py'), 'sender:create_app()']
+        run()
+    else:
+        logger.info("=== Starting Sender Application ===")
+        sender = Sender()
+        logger.info("Starting Bottle server on 0.0.0.0:8080")
+        sender.run(host='0.0.0.0', port=8080, debug=True)
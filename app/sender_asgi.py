@@ -0,0 +1,216 @@
+"""Versão assíncrona (ASGI) da API do Sender
+
+Mesmas rotas `/` e `/api` do sender.py, mas com asyncpg e redis.asyncio,
+então um único processo atende milhares de requisições simultâneas sem
+bloquear em I/O. Rode com uvicorn (uvloop + httptools):
+
+    uvicorn sender_asgi:app --host 0.0.0.0 --port 8080 --loop uvloop --http httptools
+"""
+import os
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+import asyncpg
+import redis.asyncio as aioredis
+import redis.exceptions
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from queues import QUEUE_TRANSPORT, QUEUE_KEY, STREAM_KEY, STREAM_MAXLEN, SCHEDULED_KEY, PRIORITIES, PRIORITY_DEFAULT, \
+    lane_key
+from outbox import PENDING, QUEUED, OUTBOX_CHANNEL, build_payload
+from validation import length_error
+from bodies import body_hash, should_offload
+from idempotency import AsyncIdempotencyCache, request_key
+from schedule import SCHEDULED, parse_send_at
+from logs import setup_logging, debug_sampled
+
+setup_logging('sender')
+logger = logging.getLogger(__name__)
+
+REDIS_DISABLED = os.getenv('REDIS_DISABLED', 'false').lower() == 'true'
+OUTBOX = os.getenv('OUTBOX', 'false').lower() == 'true'
+
+
+@asynccontextmanager
+async def lifespan(app):
+    logger.info("=== Starting async Sender Application ===")
+    app.state.pool = await asyncpg.create_pool(
+        host=os.getenv('DB_HOST', 'db'),
+        port=int(os.getenv('DB_PORT', 5432)),
+        user=os.getenv('DB_USER', 'postgres'),
+        password=os.getenv('DB_PASS', 'postgres'),
+        database=os.getenv('DB_NAME', 'email_sender'),
+        min_size=int(os.getenv('DB_POOL_MIN', 1)),
+        max_size=int(os.getenv('DB_POOL_MAX', 10)),
+        max_inactive_connection_lifetime=float(os.getenv('DB_POOL_IDLE_TIMEOUT', 300)),
+        timeout=5,
+    )
+    app.state.fila = aioredis.Redis(
+        host=os.getenv('REDIS_HOST', 'queue'),
+        port=int(os.getenv('REDIS_PORT', 6379)),
+        password=os.getenv('REDIS_PASSWORD'),
+        db=0,
+        socket_connect_timeout=5,
+        socket_timeout=5,
+        max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', 100)),
+    )
+    app.state.idempotency = AsyncIdempotencyCache(app.state.fila)
+    logger.info("=== Async Sender Application initialized successfully ===")
+    try:
+        yield
+    finally:
+        await app.state.pool.close()
+        await app.state.fila.close()
+
+
+async def push(fila, payloads, priority=PRIORITY_DEFAULT, send_at=None):
+    """Versão assíncrona de queues.Producer.push (todas na mesma prioridade e horário)"""
+    async with fila.pipeline(transaction=False) as pipe:
+        if send_at is not None:
+            score = send_at.replace(tzinfo=timezone.utc).timestamp()
+            pipe.zadd(lane_key(priority, SCHEDULED_KEY), {payload: score for payload in payloads})
+            pipe.zcard(lane_key(priority, SCHEDULED_KEY))
+        elif QUEUE_TRANSPORT == 'stream':
+            stream = lane_key(priority, STREAM_KEY)
+            for payload in payloads:
+                pipe.xadd(stream, {'payload': payload}, maxlen=STREAM_MAXLEN, approximate=True)
+            pipe.xlen(stream)
+        else:
+            pipe.rpush(lane_key(priority, QUEUE_KEY), *payloads)
+        return (await pipe.execute())[-1]
+
+
+async def register_message(app, assunto, mensagem, email, prioridade=PRIORITY_DEFAULT, enviar_em=None):
+    SQL = 'INSERT INTO emails (data, assunto, mensagem, email, status, corpo_hash, prioridade, agendado_para) ' \
+          'VALUES ($1, $2, $3, $4, $5, $6, $7, $8) RETURNING id'
+    now = datetime.utcnow()
+    queue_now = not (OUTBOX or REDIS_DISABLED)
+    corpo_hash = body_hash(mensagem) if should_offload(mensagem) else None
+    inline = None if corpo_hash else mensagem
+    status = (SCHEDULED if enviar_em else QUEUED) if queue_now else PENDING
+    params = (now, assunto, inline, email, status, corpo_hash, prioridade, enviar_em)
+
+    try:
+        async with app.state.pool.acquire() as conn:
+            if queue_now and not corpo_hash:
+                msg_id = await conn.fetchval(SQL, *params)
+            else:
+                async with conn.transaction():
+                    if corpo_hash:
+                        await conn.execute('INSERT INTO corpos (hash, conteudo) VALUES ($1, $2) '
+                                           'ON CONFLICT (hash) DO NOTHING', corpo_hash, mensagem)
+                    msg_id = await conn.fetchval(SQL, *params)
+                    if not queue_now:
+                        await conn.execute(f'NOTIFY {OUTBOX_CHANNEL}')
+    except Exception as e:
+        logger.error("[DB ERROR] %s", e)
+        raise
+
+    if not queue_now:
+        return
+
+    try:
+        payload = build_payload(msg_id, now, assunto, inline, email, corpo_hash=corpo_hash, prioridade=prioridade)
+        result = await push(app.state.fila, [payload], prioridade, enviar_em)
+        logger.debug('[REDIS] Message pushed to queue successfully! Queue length: %s', result)
+    except Exception as e:
+        logger.error("[REDIS ERROR] %s", e)
+        logger.warning("[REDIS] Leaving message pending in the outbox")
+        async with app.state.pool.acquire() as conn:
+            await conn.execute('UPDATE emails SET status = $1 WHERE id = $2', PENDING, msg_id)
+
+
+async def index(request):
+    return PlainTextResponse("To rodando papai!!")
+
+
+async def send(request):
+    idempotency = request.app.state.idempotency
+    key = None
+    try:
+        form = await request.form()
+        assunto = form.get('assunto')
+        mensagem = form.get('mensagem')
+        email = form.get('email')
+        prioridade = form.get('prioridade') or PRIORITY_DEFAULT
+        enviar_em = form.get('enviar_em')
+
+        if not (assunto and mensagem and email):
+            error_msg = "Campos obrigatórios: assunto, mensagem, email."
+            logger.error("[ERROR] %s", error_msg)
+            return PlainTextResponse(error_msg, status_code=400)
+        error_msg = length_error({'assunto': assunto, 'email': email})
+        if error_msg:
+            logger.error("[ERROR] %s", error_msg)
+            return PlainTextResponse(error_msg, status_code=400)
+        if prioridade not in PRIORITIES:
+            error_msg = f"prioridade deve ser uma de: {', '.join(PRIORITIES)}."
+            logger.error("[ERROR] %s", error_msg)
+            return PlainTextResponse(error_msg, status_code=400)
+        try:
+            send_at = parse_send_at(enviar_em) if enviar_em else None
+        except ValueError as e:
+            error_msg = f"enviar_em inválido (use ISO 8601, ex.: 2030-01-31T09:00:00-03:00): {e}"
+            logger.error("[ERROR] %s", error_msg)
+            return PlainTextResponse(error_msg, status_code=400)
+
+        key, ttl = (None, 0) if REDIS_DISABLED else request_key(
+            'api', request.headers.get('idempotency-key'),
+            {'assunto': assunto, 'mensagem': mensagem, 'email': email, 'enviar_em': enviar_em})
+        previous = None
+        if key:
+            try:
+                previous = await idempotency.claim(key, ttl)
+            except redis.exceptions.RedisError as e:
+                logger.error("[IDEMPOTENCY] Could not claim request, continuing without dedup: %s", e)
+                key = None
+            if previous is not None:
+                if not previous:
+                    return PlainTextResponse("Mensagem idêntica ainda em processamento.", status_code=409)
+                return PlainTextResponse(previous['body'], status_code=previous['status'],
+                                         headers={'Idempotent-Replayed': 'true'})
+
+        logger.info("[RECEBIDO] assunto=%s email=%s prioridade=%s", assunto, email, prioridade)
+        debug_sampled(logger, "[REQUEST] mensagem: %s", mensagem)
+        await register_message(request.app, assunto, mensagem, email, prioridade, send_at)
+        if send_at:
+            success_msg = f'Mensagem agendada para {send_at.isoformat()} UTC! Assunto: {assunto} ' \
+                          f'Mensagem: {mensagem} Email: {email}'
+        else:
+            success_msg = f'Mensagem enfileirada! Assunto: {assunto} Mensagem: {mensagem} Email: {email}'
+        if key:
+            try:
+                await idempotency.complete(key, ttl, 200, success_msg)
+            except redis.exceptions.RedisError as e:
+                logger.error("[IDEMPOTENCY] Could not store response: %s", e)
+        return PlainTextResponse(success_msg)
+    except Exception as e:
+        logger.error("[ERRO] %s", e)
+        if key:
+            try:
+                await idempotency.release(key)
+            except redis.exceptions.RedisError as redis_error:
+                logger.error("[IDEMPOTENCY] Could not release request: %s", redis_error)
+        return PlainTextResponse(str(e), status_code=500)
+
+
+app = Starlette(
+    routes=[
+        Route('/', index, methods=['GET']),
+        Route('/api', send, methods=['POST']),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['GET', 'POST', 'OPTIONS'],
+                   allow_headers=['Origin', 'Accept', 'Content-Type', 'X-Requested-With', 'Idempotency-Key']),
+    ],
+    lifespan=lifespan,
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.getenv('PORT', 8080)), loop='uvloop', http='httptools')
@@ -1,8 +1,8 @@
 import os 
-import psycopg2
 import json
 from bottle import Bottle, request, response, hook
 from datetime import datetime
+from db_pool import PostgresPool
 
 class Sender(Bottle):
     def __init__(self):
@@ -16,6 +16,7 @@ class Sender(Bottle):
                    f"user={os.getenv('DB_USER', 'postgres')} " \
                    f"password={os.getenv('DB_PASS', 'postgres')} " \
                    f"host={os.getenv('DB_HOST', 'db')}"
+        self.pool = PostgresPool.from_env(self.dsn)
 
         # Rotas
         self.route('/api', method='POST', callback=self.send)
@@ -37,13 +38,11 @@ class Sender(Bottle):
         now = datetime.utcnow()
 
         try:
-            print(f"[DB] Attempting to connect with DSN: {self.dsn}")
-            with psycopg2.connect(self.dsn, connect_timeout=5) as conn:
-                print("[DB] Connection successful!")
+            with self.pool.connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute(SQL, (now, assunto, mensagem, email))
-                    conn.commit()
-                    print("[DB] Insert successful!")
+                conn.commit()
+                print("[DB] Insert successful!")
         except Exception as e:
             print(f"[DB ERROR] {e}")
             raise
@@ -0,0 +1,126 @@
+"""Registro do resultado de cada envio na tabela `emails`
+
+O worker não faz um UPDATE por mensagem: os resultados ficam em um buffer
+e uma thread grava tudo a cada STATUS_FLUSH_INTERVAL segundos (ou quando o
+buffer chega a STATUS_BATCH_SIZE) com um único UPDATE ... FROM (VALUES ...).
+Se o Postgres estiver fora do ar o envio continua; os resultados esperam no
+buffer até STATUS_BUFFER_MAX e depois os mais antigos são descartados.
+"""
+import os
+import logging
+import threading
+from datetime import datetime
+
+from psycopg2.extras import execute_values
+
+
+logger = logging.getLogger(__name__)
+
+SENT = 'enviada'
+RETRYING = 'reagendada'
+FAILED = 'falhou'
+
+STATUS_TRACKING = os.getenv('STATUS_TRACKING', 'true').lower() == 'true'
+STATUS_FLUSH_INTERVAL = float(os.getenv('STATUS_FLUSH_INTERVAL', 1))
+STATUS_BATCH_SIZE = int(os.getenv('STATUS_BATCH_SIZE', 1000))
+STATUS_BUFFER_MAX = int(os.getenv('STATUS_BUFFER_MAX', 100000))
+
+UPDATE_SQL = """
+UPDATE emails AS e
+SET status = v.status,
+    tentativas = v.tentativas,
+    provedor_id = COALESCE(v.provedor_id, e.provedor_id),
+    enviado_em = COALESCE(v.enviado_em, e.enviado_em),
+    erro = v.erro
+FROM (VALUES %s) AS v(id, status, tentativas, provedor_id, enviado_em, erro)
+WHERE e.id = v.id
+"""
+UPDATE_TEMPLATE = '(%s::integer, %s, %s::integer, %s, %s::timestamp, %s)'
+
+
+def provider_id(result):
+    """Id devolvido pelo Resend para um e-mail, se houver"""
+    return result.get('id') if isinstance(result, dict) else None
+
+
+class StatusWriter(threading.Thread):
+    """Acumula os resultados dos envios e os grava em lote"""
+
+    def __init__(self, pool, flush_interval=STATUS_FLUSH_INTERVAL, batch_size=STATUS_BATCH_SIZE,
+                 buffer_max=STATUS_BUFFER_MAX):
+        super().__init__(name='status-writer', daemon=True)
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.buffer_max = buffer_max
+        self.dropped = 0
+        # id -> linha do UPDATE; só a atualização mais recente de cada id vale
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+
+    def record(self, rows):
+        with self._lock:
+            for row in rows:
+                if row[0] is not None:
+                    self._pending.pop(row[0], None)
+                    self._pending[row[0]] = row
+            while len(self._pending) > self.buffer_max:
+                self._pending.pop(next(iter(self._pending)))
+                self.dropped += 1
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def sent(self, mensagens, results):
+        now = datetime.utcnow()
+        self.record([(mensagem.get('id'), SENT, int(mensagem.get('tentativas', 0)) + 1,
+                      provider_id(result), now, None)
+                     for mensagem, result in zip(mensagens, results)])
+
+    def failed(self, mensagens, error, retrying):
+        """`mensagens` como devolvidas por RetryScheduler.schedule (tentativas já contadas)"""
+        status = RETRYING if retrying else FAILED
+        self.record([(mensagem.get('id'), status, int(mensagem.get('tentativas', 0)),
+                      None, None, str(error))
+                     for mensagem in mensagens])
+
+    def flush(self):
+        """Grava o buffer em um único UPDATE; retorna quantas linhas enviou"""
+        with self._lock:
+            if not self._pending:
+                return 0
+            rows = list(self._pending.values())
+            self._pending = {}
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    execute_values(cur, UPDATE_SQL, rows, template=UPDATE_TEMPLATE,
+                                   page_size=self.batch_size)
+                conn.commit()
+        except Exception as e:
+            logger.error(f"❌ Erro ao gravar o status de {len(rows)} email(s): {e}")
+            # Volta para o buffer sem sobrescrever atualizações que chegaram depois
+            with self._lock:
+                for row in rows:
+                    self._pending.setdefault(row[0], row)
+            return 0
+        if self.dropped:
+            logger.warning(f"⚠️ {self.dropped} atualização(ões) de status descartada(s) com o buffer cheio")
+            self.dropped = 0
+        return len(rows)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+        self.flush()
+
+    def stop(self, timeout=10):
+        """Para a thread depois de gravar o que estiver no buffer"""
+        self._stop_event.set()
+        self._wake.set()
+        if self.is_alive():
+            self.join(timeout)
@@ -0,0 +1,84 @@
+"""Templates de e-mail guardados uma única vez no banco
+
+Uma campanha cria o template (`POST /api/templates`) e cada mensagem leva só
+o id dele e as variáveis do destinatário, em vez do HTML inteiro. O worker
+renderiza na hora do envio com string.Template (`$nome` ou `${nome}`); as
+linhas lidas do banco ficam em um cache LRU por processo, o que poupa a
+consulta, não a substituição. Templates não são editados depois de criados
+(crie um novo), então o cache nunca fica velho.
+Os valores das variáveis são escapados no corpo HTML, mas não no assunto.
+"""
+import os
+import html
+import logging
+import threading
+from collections import OrderedDict
+from string import Template
+
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_CACHE_SIZE = int(os.getenv('TEMPLATE_CACHE_SIZE', 256))
+# Tamanho das colunas varchar de `templates` (scripts/init.sql)
+TEMPLATE_MAX_LENGTH = {'nome': 100, 'assunto': 255}
+
+
+class TemplateError(Exception):
+    """Template inexistente ou variáveis que não fecham com ele"""
+
+
+class TemplateCache:
+    """Assunto e corpo de cada template por id, com descarte do menos usado"""
+
+    def __init__(self, pool, size=TEMPLATE_CACHE_SIZE):
+        self.pool = pool
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, template_id):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('SELECT assunto, corpo FROM templates WHERE id = %s', (template_id,))
+                row = cur.fetchone()
+            conn.rollback()
+        if row is None:
+            raise TemplateError(f"Template {template_id} não existe")
+        return Template(row[0]), Template(row[1])
+
+    def get(self, template_id):
+        with self._lock:
+            entry = self._cache.get(template_id)
+            if entry is not None:
+                self._cache.move_to_end(template_id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        # Busca fora do lock; duas threads podem carregar o mesmo id, sem problema
+        entry = self.load(template_id)
+        with self._lock:
+            self._cache[template_id] = entry
+            while len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+        return entry
+
+    def render(self, mensagem):
+        """Retorna (assunto, html) de uma mensagem com `template` e `variaveis`
+
+        Um `assunto` na própria mensagem tem precedência sobre o do template.
+        """
+        try:
+            assunto, corpo = self.get(int(mensagem['template']))
+            variaveis = mensagem.get('variaveis') or {}
+            escapadas = {nome: html.escape(str(valor)) for nome, valor in variaveis.items()}
+            return (mensagem.get('assunto') or assunto.substitute(variaveis),
+                    corpo.substitute(escapadas))
+        except KeyError as e:
+            raise TemplateError(f"Variável {e} ausente para o template {mensagem['template']}")
+        except (TypeError, ValueError, AttributeError) as e:
+            raise TemplateError(f"Template {mensagem['template']} inválido: {e}")
+
+    def info(self):
+        return {'size': len(self._cache), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,359 @@
+"""Transportes de e-mail usados pelo DeliveryEngine
+
+EMAIL_TRANSPORT escolhe o backend:
+
+- `resend` (padrão): API do Resend, um lote de até 100 e-mails por chamada
+- `smtp`: um MTA próprio, por um pool de conexões já autenticadas que são
+  reaproveitadas entre as mensagens, sem TCP + TLS + AUTH a cada e-mail
+
+Os dois recebem os e-mails no formato do Resend ({from, to, subject, html})
+e retornam uma resposta por e-mail, na mesma ordem ({'id': ...}). Um erro
+que atinge o lote inteiro é levantado; o SMTP, que envia uma mensagem por
+vez, devolve a exceção no lugar da resposta das que foram recusadas.
+"""
+import os
+import ssl
+import time
+import logging
+import smtplib
+import threading
+from email.header import Header
+from email.mime.text import MIMEText
+from email.utils import formatdate, make_msgid
+
+import requests
+import resend
+from requests.adapters import HTTPAdapter
+from resend.exceptions import raise_for_code_and_type
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+EMAIL_TRANSPORT = os.getenv('EMAIL_TRANSPORT', 'resend').lower()
+# Outra URL para a API do Resend, ex.: o servidor falso do bench/fake_resend.py
+RESEND_API_URL = os.getenv('RESEND_API_URL') or 'https://api.resend.com'
+
+
+class SMTPDeliveryError(Exception):
+    """Resposta de erro do servidor SMTP; `code` é o código SMTP (5xx é permanente)"""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.permanent = 500 <= code < 600
+
+
+class ResendTransport:
+    """Chama a API do Resend por uma sessão HTTP persistente, compartilhada pelas threads de envio
+
+    O SDK abre uma conexão (TCP + TLS) nova a cada chamada. Aqui as conexões
+    ficam em um pool keep-alive de até `pool_size` conexões, uma por envio
+    simultâneo, e são reaproveitadas entre os lotes. Só falhas ao conectar
+    são repetidas: um POST que chegou ao provedor nunca é reenviado aqui.
+    """
+
+    name = 'resend'
+
+    def __init__(self, api_key=None, api_url=RESEND_API_URL, pool_size=10, connect_timeout=5, timeout=30):
+        self.api_key = api_key or resend.api_key
+        self.api_url = api_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, timeout)
+        self._closed_counts = None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True,
+                              max_retries=Retry(total=None, connect=2, read=0, status=0, other=0, redirect=0))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Authorization': f'Bearer {self.api_key}',
+            'User-Agent': 'send-emails',
+        })
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            api_key=os.getenv('RESEND_API_KEY'),
+            pool_size=int(os.getenv('RESEND_POOL_SIZE', os.getenv('WORKER_CONCURRENCY', 10))),
+            connect_timeout=float(os.getenv('RESEND_CONNECT_TIMEOUT', 5)),
+            timeout=float(os.getenv('RESEND_TIMEOUT', 30)),
+        )
+
+    def post(self, path, payload):
+        response = self.session.post(f'{self.api_url}{path}', json=payload, timeout=self.timeout)
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        if response.status_code != 200:
+            # Mesmas exceções do SDK, com o status em `code` para o retry.is_permanent
+            error = body if isinstance(body, dict) else {}
+            raise_for_code_and_type(code=error.get('statusCode') or response.status_code,
+                                    error_type=error.get('name', 'application_error'),
+                                    message=error.get('message') or response.text[:200])
+        return body
+
+    def send(self, emails):
+        if len(emails) == 1:
+            return [self.post('/emails', emails[0])]
+        response = self.post('/emails/batch', emails)
+        results = response.get('data') if isinstance(response, dict) else response
+        if not isinstance(results, list) or len(results) != len(emails):
+            raise ValueError(f"Resposta inesperada da API de lote: {response}")
+        return results
+
+    def _pool_counts(self):
+        requests_made = connections = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    requests_made += pool.num_requests
+                    connections += pool.num_connections
+        return requests_made, connections
+
+    def close(self):
+        # O close() descarta os pools e os contadores deles: guarda os totais
+        self._closed_counts = self._pool_counts()
+        self.session.close()
+
+    def stats(self):
+        """Requisições feitas e conexões abertas: `reused` são as que não pagaram handshake"""
+        requests_made, connections = self._closed_counts or self._pool_counts()
+        return {
+            'transport': self.name,
+            'pool_size': self.pool_size,
+            'requests': requests_made,
+            'connections': connections,
+            'reused': max(0, requests_made - connections),
+            'reuse_ratio': round(1 - connections / requests_made, 3) if requests_made else 0.0,
+        }
+
+
+class SMTPPool:
+    """Conexões SMTP autenticadas reaproveitadas em ordem LIFO
+
+    Abre sob demanda até `size` conexões. Uma conexão é fechada depois de
+    `max_messages` envios (muitos MTAs limitam mensagens por sessão) ou se
+    ficou parada mais de `idle_timeout` segundos, antes que o servidor a
+    derrube no meio de um envio.
+    """
+
+    def __init__(self, host, port=587, username=None, password=None, security='starttls', size=10,
+                 timeout=30, max_messages=1000, idle_timeout=60, wait_timeout=30):
+        if security not in ('starttls', 'ssl', 'none'):
+            raise ValueError(f"SMTP_SECURITY inválido: {security} (use starttls, ssl ou none)")
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.security = security
+        self.size = size
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self._context = ssl.create_default_context()
+
+        self._cond = threading.Condition()
+        self._idle = []      # [(conexão, mensagens enviadas, usada_em)], a mais recente no fim
+        self._total = 0      # conexões abertas ou sendo abertas
+        self._checkouts = 0
+        self._opened = 0
+        self._discarded = 0
+
+    def _connect(self):
+        if self.security == 'ssl':
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout, context=self._context)
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.ehlo()
+            if self.security == 'starttls':
+                conn.starttls(context=self._context)
+                conn.ehlo()
+            if self.username:
+                conn.login(self.username, self.password or '')
+        except Exception:
+            self._close(conn)
+            raise
+        with self._cond:
+            self._opened += 1
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
+
+    def getconn(self):
+        """Retorna (conexão, mensagens já enviadas por ela), esperando até `wait_timeout`"""
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            with self._cond:
+                while not self._idle and self._total >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"Nenhuma conexão SMTP livre em {self.wait_timeout}s")
+                    self._cond.wait(remaining)
+                self._checkouts += 1
+                if self._idle:
+                    conn, sent, used_at = self._idle.pop()
+                else:
+                    self._total += 1
+                    conn = None
+            if conn is None:
+                try:
+                    return self._connect(), 0
+                except Exception:
+                    self._release_slot()
+                    raise
+            if time.monotonic() - used_at < self.idle_timeout:
+                return conn, sent
+            self._discard(conn)
+
+    def putconn(self, conn, sent, discard=False):
+        if discard or sent >= self.max_messages:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, sent, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, conn):
+        self._close(conn)
+        with self._cond:
+            self._discarded += 1
+        self._release_slot()
+
+    def _release_slot(self):
+        with self._cond:
+            self._total -= 1
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._total -= len(idle)
+        for conn, _, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'total': self._total,
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'opened': self._opened,
+                'discarded': self._discarded,
+            }
+
+
+class SMTPTransport:
+    """Envia pelo SMTPPool; cada lote usa uma conexão do começo ao fim"""
+
+    name = 'smtp'
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @classmethod
+    def from_env(cls):
+        return cls(SMTPPool(
+            host=os.getenv('SMTP_HOST', 'localhost'),
+            port=int(os.getenv('SMTP_PORT', 587)),
+            username=os.getenv('SMTP_USER'),
+            password=os.getenv('SMTP_PASSWORD'),
+            security=os.getenv('SMTP_SECURITY', 'starttls').lower(),
+            size=int(os.getenv('SMTP_POOL_SIZE', os.getenv('WORKER_CONCURRENCY', 10))),
+            timeout=float(os.getenv('SMTP_TIMEOUT', 30)),
+            max_messages=int(os.getenv('SMTP_MAX_MESSAGES', 1000)),
+            idle_timeout=float(os.getenv('SMTP_IDLE_TIMEOUT', 60)),
+        ))
+
+    @staticmethod
+    def build_message(email):
+        # MIMEText (política compat32): o EmailMessage analisa cada cabeçalho e custa
+        # vários ms de CPU por mensagem, o que limita a vazão do worker sob o GIL
+        to = email['to']
+        message = MIMEText(email['html'], 'html', 'utf-8')
+        message['From'] = email['from']
+        message['To'] = ', '.join(to) if isinstance(to, (list, tuple)) else to
+        message['Subject'] = Header(email['subject'], 'utf-8')
+        message['Date'] = formatdate(localtime=False)
+        message['Message-ID'] = make_msgid(domain=email['from'].rpartition('@')[2].strip('> ') or None)
+        return message
+
+    @staticmethod
+    def _send_one(conn, message):
+        """Envia uma mensagem; recusas do servidor viram SMTPDeliveryError"""
+        try:
+            conn.send_message(message)
+        except smtplib.SMTPRecipientsRefused as e:
+            code, reply = next(iter(e.recipients.values()))
+            raise SMTPDeliveryError(code, reply.decode(errors='replace')) from e
+        except smtplib.SMTPResponseException as e:
+            # A sessão continua válida depois de uma recusa
+            try:
+                conn.rset()
+            except smtplib.SMTPException:
+                pass
+            raise SMTPDeliveryError(e.smtp_code, e.smtp_error.decode(errors='replace')) from e
+        return {'id': message['Message-ID']}
+
+    def send(self, emails):
+        messages = [self.build_message(email) for email in emails]
+        results = []
+        # Sem conexão nenhuma a exceção sobe e o lote inteiro é reagendado
+        conn, sent = self.pool.getconn()
+        try:
+            for index, message in enumerate(messages):
+                try:
+                    if sent >= self.pool.max_messages:
+                        # Limite de mensagens por sessão no meio do lote: troca de conexão
+                        self.pool.putconn(conn, sent)
+                        conn = None
+                        conn, sent = self.pool.getconn()
+                    try:
+                        result = self._send_one(conn, message)
+                    except OSError as e:
+                        # Conexão caiu (ou expirou no servidor): tenta uma vez em uma nova
+                        logger.warning("[SMTP] Connection lost after %d message(s), reconnecting: %s", index, e)
+                        self.pool.putconn(conn, sent, discard=True)
+                        conn = None
+                        conn, sent = self.pool.getconn()
+                        result = self._send_one(conn, message)
+                except SMTPDeliveryError as e:
+                    result = e
+                except OSError as e:
+                    # As já aceitas pelo servidor não podem voltar para a fila: só o resto do lote falha
+                    if conn is not None:
+                        self.pool.putconn(conn, sent, discard=True)
+                        conn = None
+                    results.extend([e] * (len(messages) - index))
+                    return results
+                results.append(result)
+                sent += 1
+        finally:
+            if conn is not None:
+                self.pool.putconn(conn, sent)
+        return results
+
+    def close(self):
+        self.pool.closeall()
+
+    def stats(self):
+        return {'transport': self.name, **self.pool.stats()}
+
+
+def open_transport(name=EMAIL_TRANSPORT):
+    """Cria o transporte configurado em EMAIL_TRANSPORT"""
+    if name == 'resend':
+        return ResendTransport.from_env()
+    if name == 'smtp':
+        return SMTPTransport.from_env()
+    raise ValueError(f"EMAIL_TRANSPORT inválido: {name} (use resend ou smtp)")
@@ -0,0 +1,14 @@
+"""Validação dos campos recebidos pela API antes de gravar no Postgres"""
+
+# Tamanho das colunas varchar de `emails` (scripts/init.sql)
+FIELD_MAX_LENGTH = {'assunto': 100, 'email': 100}
+
+
+def length_error(fields, limits=FIELD_MAX_LENGTH):
+    """Retorna o erro se algum campo não cabe na sua coluna, ou None"""
+    too_long = [field for field, limit in limits.items()
+                if isinstance(fields.get(field), str) and len(fields[field]) > limit]
+    if too_long:
+        return "Campos maiores que o permitido: " + ', '.join(
+            f"{field} (máx. {limits[field]})" for field in too_long)
+    return None
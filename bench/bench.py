@@ -0,0 +1,286 @@
+"""Benchmark de ponta a ponta da API e do worker contra um Resend falso
+
+Mede requisições/s e latência (p50/p90/p99) do POST /api com N clientes
+simultâneos e depois a vazão do worker (e-mails/s) e o tempo para esvaziar
+a fila. O provedor é o bench/fake_resend.py (ou o bench/fake_smtp.py, com
+--transport smtp), com latência e taxa de erro configuráveis. Usa o Postgres das variáveis DB_* (de preferência um banco
+só para o benchmark) e o Redis de REDIS_HOST, ou um Redis em memória com
+--fake-redis (exige fakeredis). Cada execução é salva em bench/results/
+com o commit, para comparar com --baseline:
+
+    python bench/bench.py --requests 5000 --concurrency 50 --messages 20000
+    python bench/bench.py --url http://localhost:8080   # API já rodando (gunicorn)
+    python bench/bench.py --baseline bench/results/20261018-101500-7f3d3cf.json
+
+Sem --url a API sobe neste processo, em um servidor WSGI com threads que
+divide o GIL com os clientes: os números servem para comparar commits, não
+como capacidade de produção.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import threading
+import subprocess
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+sys.path.insert(0, os.path.join(ROOT, 'app'))
+# Um log por lote do worker atrapalharia a saída e o próprio benchmark
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import requests  # noqa: E402
+from fake_resend import FakeResend  # noqa: E402
+from fake_smtp import FakeSMTP  # noqa: E402
+
+# Métricas comparadas com o --baseline: (fase, chave, maior é melhor)
+COMPARED = (
+    ('api', 'rps', True),
+    ('api', 'p50_ms', False),
+    ('api', 'p99_ms', False),
+    ('worker', 'emails_per_s', True),
+    ('worker', 'drain_s', False),
+)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def use_fake_redis():
+    """Troca o cliente Redis por um fakeredis compartilhado antes de importar a aplicação"""
+    import redis
+    import fakeredis
+    server = fakeredis.FakeServer()
+    redis.StrictRedis = redis.Redis = lambda *args, **kwargs: fakeredis.FakeStrictRedis(server=server)
+
+
+def serve_app():
+    """Sobe o sender.py em um servidor WSGI com threads; retorna (url, aplicação)"""
+    from socketserver import ThreadingMixIn
+    from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+    import sender
+
+    class Server(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+        request_queue_size = 1024
+
+    class Handler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    app = sender.Sender()
+    httpd = make_server('127.0.0.1', 0, app, Server, Handler)
+    threading.Thread(target=httpd.serve_forever, name='bench-api', daemon=True).start()
+    return f'http://127.0.0.1:{httpd.server_port}', app
+
+
+def bench_api(url, total, concurrency, body_size):
+    """POST /api `total` vezes a partir de `concurrency` threads com keep-alive"""
+    counter = itertools.count()
+    latencies = []
+    errors = []
+    filler = 'x' * max(0, body_size)
+
+    def client():
+        session = requests.Session()
+        while True:
+            i = next(counter)
+            if i >= total:
+                return
+            # Conteúdo único: a deduplicação por hash não pode responder do cache
+            data = {'assunto': f'Benchmark {i}', 'mensagem': f'Mensagem {i} {filler}',
+                    'email': f'bench{i}@example.com'}
+            started = time.perf_counter()
+            try:
+                ok = session.post(f'{url}/api', data=data, timeout=30).status_code == 200
+            except requests.RequestException:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors.append(i)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': total,
+        'errors': len(errors),
+        'elapsed_s': round(elapsed, 3),
+        'rps': round(total / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p90_ms': round(percentile(latencies, 90) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(max(latencies) * 1000, 2),
+    }
+
+
+def seed_queue(redis_conn, messages, body_size):
+    """Enfileira `messages` mensagens sintéticas direto no Redis, sem passar pelo banco"""
+    from queues import Producer
+    from outbox import build_payload
+    now = datetime.utcnow()
+    filler = 'x' * max(0, body_size)
+    payloads = [build_payload(10 ** 9 + i, now, 'Benchmark', f'Mensagem {i} {filler}', f'worker{i}@example.com')
+                for i in range(messages)]
+    Producer(redis_conn).push(payloads)
+
+
+def bench_worker(redis_conn, concurrency, timeout):
+    """Roda o laço do worker até a fila esvaziar; mede a vazão e o tempo de drenagem"""
+    import delivery
+    from queues import open_queue, lane_depths
+
+    queue = open_queue(redis_conn, consumer='bench')
+    backlog = sum(lane_depths(redis_conn, queue.transport).values())
+    engine = delivery.DeliveryEngine(queue, 'bench@example.com', concurrency=concurrency)
+    before = delivery.MESSAGES.values()
+    running = threading.Event()
+    running.set()
+
+    def in_flight():
+        return delivery.BATCHES_STARTED.total() - delivery.BATCHES_FINISHED.total()
+
+    started = time.perf_counter()
+    consumer = threading.Thread(target=delivery.run_consumer, args=(queue, engine, running.is_set), daemon=True)
+    consumer.start()
+    deadline = started + timeout
+    while time.perf_counter() < deadline:
+        if not sum(lane_depths(redis_conn, queue.transport).values()) and not in_flight():
+            break
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    running.clear()
+    consumer.join()
+
+    after = delivery.MESSAGES.values()
+    results = {result: after.get((result,), 0) - before.get((result,), 0)
+               for result in ('sent', 'retried', 'dead', 'invalid')}
+    return {
+        'backlog': backlog,
+        'drained': elapsed < timeout,
+        'drain_s': round(elapsed, 3),
+        'emails_per_s': round(results['sent'] / elapsed, 1),
+        **results,
+        'transport': engine.transport.stats(),
+    }
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                        cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'desconhecido'
+    return commit + ('-dirty' if dirty else '')
+
+
+def save(result):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{result['commit']}.json")
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2)
+    return path
+
+
+def compare(result, baseline):
+    print(f"\nComparação com {baseline['commit']} ({baseline['date']}):")
+    for phase, key, higher_is_better in COMPARED:
+        old = baseline.get(phase, {}).get(key)
+        new = result.get(phase, {}).get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        better = change > 0 if higher_is_better else change < 0
+        mark = '✅' if better else '⚠️' if abs(change) >= 5 else '  '
+        print(f"  {mark} {phase}.{key}: {old} -> {new} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='API já rodando (padrão: sobe o sender.py neste processo)')
+    parser.add_argument('--requests', type=int, default=2000, help='POST /api enviados (0 pula a fase da API)')
+    parser.add_argument('--concurrency', type=int, default=20, help='clientes simultâneos na API')
+    parser.add_argument('--messages', type=int, default=10000,
+                        help='mensagens extras enfileiradas direto no Redis antes da fase do worker')
+    parser.add_argument('--worker-concurrency', type=int, default=None,
+                        help='envios simultâneos do worker (padrão: WORKER_CONCURRENCY)')
+    parser.add_argument('--no-worker', action='store_true', help='pula a fase do worker')
+    parser.add_argument('--body-size', type=int, default=200, help='bytes extras no corpo de cada mensagem')
+    parser.add_argument('--transport', choices=('resend', 'smtp'), default='resend', help='backend de envio')
+    parser.add_argument('--latency-ms', type=float, default=50, help='latência do provedor falso')
+    parser.add_argument('--jitter-ms', type=float, default=10, help='variação da latência (só resend)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fração das chamadas que falham')
+    parser.add_argument('--error-code', type=int, help='status HTTP (padrão 500) ou código SMTP (padrão 451)')
+    parser.add_argument('--timeout', type=float, default=300, help='tempo máximo (s) para esvaziar a fila')
+    parser.add_argument('--fake-redis', action='store_true', help='Redis em memória (fakeredis)')
+    parser.add_argument('--baseline', help='resultado anterior (bench/results/*.json) para comparar')
+    args = parser.parse_args()
+
+    if args.fake_redis:
+        if args.url:
+            parser.error('--fake-redis não funciona com --url: a API externa usa outro Redis')
+        use_fake_redis()
+
+    os.environ['EMAIL_TRANSPORT'] = args.transport
+    if args.transport == 'smtp':
+        fake = FakeSMTP(latency_ms=args.latency_ms, error_rate=args.error_rate,
+                        error_code=args.error_code or 451).start()
+        os.environ['SMTP_HOST'], port = fake.address
+        os.environ['SMTP_PORT'] = str(port)
+        os.environ['SMTP_SECURITY'] = 'none'
+    else:
+        fake = FakeResend(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                          error_rate=args.error_rate, error_code=args.error_code or 500).start()
+        os.environ['RESEND_API_URL'] = fake.url
+        os.environ['RESEND_API_KEY'] = os.getenv('RESEND_API_KEY') or 're_bench'
+    # Sem limite de envio: o que se mede é o worker, não a cota configurada
+    os.environ.pop('RATE_LIMITS', None)
+
+    result = {'commit': git_commit(), 'date': datetime.now().isoformat(timespec='seconds'),
+              'params': vars(args)}
+    app = None
+    url = args.url
+    if args.requests:
+        if url is None:
+            url, app = serve_app()
+        print(f"API: {args.requests} requisições, {args.concurrency} clientes em {url}")
+        result['api'] = bench_api(url.rstrip('/'), args.requests, args.concurrency, args.body_size)
+        print(f"  {result['api']}")
+
+    if not args.no_worker:
+        import redis
+        import delivery
+        redis_conn = app.fila if app else redis.StrictRedis(
+            host=os.getenv('REDIS_HOST', 'queue'), port=6379, password=os.getenv('REDIS_PASSWORD'), db=0)
+        if args.messages:
+            seed_queue(redis_conn, args.messages, args.body_size)
+        concurrency = args.worker_concurrency or delivery.WORKER_CONCURRENCY
+        print(f"Worker: esvaziando a fila com {concurrency} envios simultâneos "
+              f"({args.transport} falso: {args.latency_ms}ms, erros {args.error_rate:.1%})")
+        result['worker'] = bench_worker(redis_conn, concurrency, args.timeout)
+        print(f"  {result['worker']}")
+
+    result['provider'] = fake.stats()
+    fake.stop()
+    print(f"{args.transport} falso: {result['provider']}")
+    print(f"Resultado salvo em {os.path.relpath(save(result), ROOT)}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
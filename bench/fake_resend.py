@@ -0,0 +1,124 @@
+"""Servidor HTTP que imita a API do Resend, para benchmarks e testes locais
+
+Aceita POST /emails e POST /emails/batch como o Resend, espera
+`latency_ms` (± `jitter_ms`) e falha uma fração `error_rate` das chamadas
+com `error_code`, no mesmo formato de erro do provedor. Aponte o worker
+para ele com RESEND_API_URL:
+
+    python bench/fake_resend.py --port 8025 --latency-ms 80 --error-rate 0.01
+    RESEND_API_URL=http://localhost:8025 python worker/worker.py
+"""
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ERROR_NAMES = {429: 'rate_limit_exceeded', 500: 'internal_server_error', 503: 'service_unavailable'}
+
+
+class FakeResend(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency_ms=50, jitter_ms=0, error_rate=0.0, error_code=500, host='127.0.0.1'):
+        super().__init__((host, port), _Handler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.emails = 0
+        self.errors = 0
+        self.connections = 0
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_port}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='fake-resend', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, emails, error):
+        with self._lock:
+            self.calls += 1
+            self.emails += 0 if error else emails
+            self.errors += 1 if error else 0
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'emails': self.emails, 'errors': self.errors,
+                    'connections': self.connections}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, como o provedor de verdade
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server._lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'null')
+        if self.path not in ('/emails', '/emails/batch'):
+            self.reply(404, {'statusCode': 404, 'name': 'not_found', 'message': 'Not found'})
+            return
+
+        server = self.server
+        delay = server.latency_ms + random.uniform(-server.jitter_ms, server.jitter_ms)
+        time.sleep(max(0, delay) / 1000)
+
+        batch = self.path == '/emails/batch'
+        emails = len(body) if batch and isinstance(body, list) else 1
+        error = random.random() < server.error_rate
+        server.count(emails, error)
+        if error:
+            self.reply(server.error_code, {'statusCode': server.error_code,
+                                           'name': ERROR_NAMES.get(server.error_code, 'application_error'),
+                                           'message': 'Erro simulado pelo fake_resend'})
+        elif batch:
+            self.reply(200, {'data': [{'id': str(uuid.uuid4())} for _ in range(emails)]})
+        else:
+            self.reply(200, {'id': str(uuid.uuid4())})
+
+    def reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1', help='0.0.0.0 para aceitar conexões de outros containers')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-code', type=int, default=500)
+    args = parser.parse_args()
+
+    server = FakeResend(args.port, args.latency_ms, args.jitter_ms, args.error_rate, args.error_code, args.host)
+    print(f'Fake Resend em {server.url} (latência {args.latency_ms}ms, erros {args.error_rate:.1%})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(server.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Servidor SMTP de depuração para benchmarks e testes locais
+
+Aceita qualquer AUTH, espera `latency_ms` no fim de cada DATA e recusa no
+RCPT uma fração `error_rate` das mensagens com `error_code` (451 é
+temporário, 550 permanente). Não guarda as mensagens, só conta conexões e
+envios. Sem TLS: use SMTP_SECURITY=none.
+
+    python bench/fake_smtp.py --port 8026 --latency-ms 5
+    EMAIL_TRANSPORT=smtp SMTP_HOST=localhost SMTP_PORT=8026 SMTP_SECURITY=none python worker/worker.py
+"""
+import time
+import random
+import argparse
+import threading
+import socketserver
+
+
+class FakeSMTP(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, latency_ms=0, error_rate=0.0, error_code=451, host='127.0.0.1'):
+        super().__init__((host, port), _Handler)
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.emails = 0
+        self.errors = 0
+
+    @property
+    def address(self):
+        return self.server_address[0], self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='fake-smtp', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def stats(self):
+        with self._lock:
+            return {'connections': self.connections, 'emails': self.emails, 'errors': self.errors}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        server.count('connections')
+        self.reply('220 fake-smtp ESMTP')
+        accepted = False
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, argument = line.decode(errors='replace').strip().partition(' ')
+            command = command.upper()
+            if command == 'EHLO':
+                self.wfile.write(b'250-fake-smtp\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n')
+            elif command == 'HELO':
+                self.reply('250 fake-smtp')
+            elif command == 'AUTH':
+                mechanism, _, initial = argument.partition(' ')
+                # LOGIN (ou PLAIN sem resposta inicial) pede os dados em linhas seguintes
+                prompts = 2 if mechanism.upper() == 'LOGIN' else 0 if initial else 1
+                for _ in range(prompts):
+                    self.reply('334 ')
+                    self.rfile.readline()
+                self.reply('235 2.7.0 Authentication successful')
+            elif command == 'MAIL':
+                accepted = False
+                self.reply('250 2.1.0 OK')
+            elif command == 'RCPT':
+                if random.random() < server.error_rate:
+                    server.count('errors')
+                    self.reply(f'{server.error_code} Recusa simulada pelo fake_smtp')
+                else:
+                    accepted = True
+                    self.reply('250 2.1.5 OK')
+            elif command == 'DATA':
+                if not accepted:
+                    self.reply('554 5.5.1 No valid recipients')
+                    continue
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                time.sleep(server.latency_ms / 1000)
+                server.count('emails')
+                self.reply('250 2.0.0 OK queued')
+            elif command == 'RSET':
+                accepted = False
+                self.reply('250 2.0.0 OK')
+            elif command == 'NOOP':
+                self.reply('250 2.0.0 OK')
+            elif command == 'QUIT':
+                self.reply('221 2.0.0 Bye')
+                return
+            else:
+                self.reply('502 5.5.2 Command not recognized')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1', help='0.0.0.0 para aceitar conexões de outros containers')
+    parser.add_argument('--port', type=int, default=8026)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-code', type=int, default=451)
+    args = parser.parse_args()
+
+    server = FakeSMTP(args.port, args.latency_ms, args.error_rate, args.error_code, args.host)
+    host, port = server.address
+    print(f'Fake SMTP em {host}:{port} (latência {args.latency_ms}ms, recusas {args.error_rate:.1%})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(server.stats())
+
+
+if __name__ == '__main__':
+    main()
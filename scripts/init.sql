@@ -1,7 +1,48 @@
+-- Templates de e-mail: o corpo é guardado uma vez e as mensagens só apontam para ele
+create table templates (
+  id serial primary key,
+  nome varchar(100) not null,
+  assunto varchar(255) not null,
+  corpo text not null,
+  criado_em timestamp not null default current_timestamp
+);
+
+-- Corpos grandes guardados uma vez, endereçados pelo SHA-256 do conteúdo
+create table corpos (
+  hash char(64) primary key,
+  conteudo text not null,
+  criado_em timestamp not null default current_timestamp
+);
+
 create table emails (
-  id serial not null,
+  id serial primary key,
   data timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
-  assunto varchar(100) not null,
-  mensagem varchar(250) not null,
-  email varchar(100) not null
-);
\ No newline at end of file
+  -- nulos quando a mensagem usa um template (o assunto, se vier, substitui o do template);
+  -- mensagem também é nula quando o corpo foi guardado em corpos (corpo_hash)
+  assunto varchar(100),
+  mensagem text,
+  email varchar(100) not null,
+  template_id integer references templates (id),
+  variaveis jsonb,
+  corpo_hash char(64) references corpos (hash),
+  -- pendente: aguardando o relay do outbox; enfileirada: já está na fila do Redis;
+  -- agendada: aguardando o horário de envio no Redis;
+  -- enviada, reagendada (nova tentativa agendada) ou falhou: gravados pelo worker
+  status varchar(20) not null default 'enfileirada',
+  -- fila usada no Redis: alta, normal ou baixa
+  prioridade varchar(10) not null default 'normal',
+  -- envio agendado (enviar_em): a mensagem fica como agendada até esse horário (UTC)
+  agendado_para timestamp,
+  tentativas integer not null default 0,
+  provedor_id varchar(100),
+  enviado_em timestamp,
+  erro text,
+  constraint emails_conteudo_check check (template_id is not null or (assunto is not null and (mensagem is not null or corpo_hash is not null)))
+);
+
+create index idx_emails_data on emails (data, id);
+-- "o que falhou na última hora para o destinatário X" e listagens por status
+create index idx_emails_email_data on emails (email, data, id);
+create index idx_emails_status_data on emails (status, data, id);
+-- Índice parcial: o relay só varre as linhas pendentes
+create index idx_emails_pendentes on emails (id) where status = 'pendente';
@@ -0,0 +1,57 @@
+-- Opcional (PostgreSQL 11+): tabela emails particionada por mês pela coluna data.
+-- Para instalações novas com muito volume, rode no lugar do init.sql. Consultas
+-- por período só leem as partições do intervalo, e apagar um mês antigo vira
+-- um DROP TABLE em vez de um DELETE. A chave primária precisa incluir a data.
+create table templates (
+  id serial primary key,
+  nome varchar(100) not null,
+  assunto varchar(255) not null,
+  corpo text not null,
+  criado_em timestamp not null default current_timestamp
+);
+
+create table corpos (
+  hash char(64) primary key,
+  conteudo text not null,
+  criado_em timestamp not null default current_timestamp
+);
+
+create table emails (
+  id serial,
+  data timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  assunto varchar(100),
+  mensagem text,
+  email varchar(100) not null,
+  template_id integer references templates (id),
+  variaveis jsonb,
+  corpo_hash char(64) references corpos (hash),
+  status varchar(20) not null default 'enfileirada',
+  prioridade varchar(10) not null default 'normal',
+  agendado_para timestamp,
+  tentativas integer not null default 0,
+  provedor_id varchar(100),
+  enviado_em timestamp,
+  erro text,
+  constraint emails_conteudo_check check (template_id is not null or (assunto is not null and (mensagem is not null or corpo_hash is not null))),
+  primary key (id, data)
+) partition by range (data);
+
+create index idx_emails_data on emails (data, id);
+create index idx_emails_email_data on emails (email, data, id);
+create index idx_emails_status_data on emails (status, data, id);
+create index idx_emails_pendentes on emails (id) where status = 'pendente';
+
+-- Cria a partição do mês de `mes` (se ainda não existir)
+create or replace function criar_particao_emails(mes date) returns void as $$
+declare
+  inicio date := date_trunc('month', mes);
+begin
+  execute format('create table if not exists %I partition of emails for values from (%L) to (%L)',
+                 'emails_' || to_char(inicio, 'YYYYMM'), inicio, inicio + interval '1 month');
+end
+$$ language plpgsql;
+
+-- Mês atual e os dois próximos; agende a chamada mensal (cron, pg_cron) para os seguintes.
+-- Linhas fora das partições criadas vão para emails_default.
+select criar_particao_emails((current_date + n * interval '1 month')::date) from generate_series(0, 2) as n;
+create table emails_default partition of emails default;
@@ -0,0 +1,41 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+from metrics import Counter, Histogram  # noqa: E402
+
+
+def run_in_threads(target, count, at_once=8):
+    """Roda `target` em `count` threads de vida curta, `at_once` por vez"""
+    for start in range(0, count, at_once):
+        threads = [threading.Thread(target=target) for _ in range(min(at_once, count - start))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+def test_counter_shards_stay_bounded_with_short_lived_threads():
+    counter = Counter('test_total', 'teste', ('result',))
+    run_in_threads(lambda: counter.inc(('ok',)), 500)
+    assert counter.values() == {('ok',): 500}
+    assert len(counter._shards) <= 8 + 1
+
+
+def test_histogram_shards_stay_bounded_with_short_lived_threads():
+    histogram = Histogram('test_seconds', 'teste', ())
+    run_in_threads(lambda: histogram.observe(0.01), 500)
+    assert histogram.values()[()][2] == 500
+    assert len(histogram._shards) <= 8 + 1
+
+
+def test_greenlets_share_the_thread_shard():
+    gevent = pytest.importorskip('gevent')
+    counter = Counter('test_greenlets_total', 'teste', ())
+    gevent.joinall([gevent.spawn(counter.inc) for _ in range(1000)])
+    assert counter.total() == 1000
+    assert len(counter._shards) == 1
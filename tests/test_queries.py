@@ -0,0 +1,28 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+from queries import decode_cursor, encode_cursor, parse_filters  # noqa: E402
+
+
+def test_cursor_round_trip():
+    data = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    assert decode_cursor(encode_cursor(data, 42)) == (data, 42)
+
+
+@pytest.mark.parametrize('params, message', [
+    ({'limite': 'abc'}, 'limite deve ser um inteiro'),
+    ({'limite': '0'}, 'limite deve estar entre 1 e'),
+    ({'apos': 'garbage'}, 'cursor apos inválido'),
+    ({'apos': '2024-05-01T12:30:15,x'}, 'cursor apos inválido'),
+    ({'desde': 'ontem'}, 'desde deve ser uma data ISO 8601'),
+    ({'ate': '2024-13-01'}, 'ate deve ser uma data ISO 8601'),
+    ({'status': 'lida'}, 'status deve ser um de'),
+])
+def test_invalid_filters_have_readable_messages(params, message):
+    with pytest.raises(ValueError, match=message):
+        parse_filters(params)
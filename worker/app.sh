@@ -1,3 +1,3 @@
 #!/bin/sh
-pip install redis==2.10.5 resend
-python -u worker.py
\ No newline at end of file
+pip install redis==4.3.4 resend==0.6.0 psycopg2-binary==2.9.5 msgpack==1.0.5 zstandard==0.21.0
+PYTHONPATH=../app python -u worker.py
\ No newline at end of file
@@ -1,118 +1,90 @@
 import redis
-import json
-import os 
-import resend
-from time import sleep
-from random import randint
-from datetime import datetime
-
-# Carrega a chave da API Resend
-resend.api_key = os.getenv('RESEND_API_KEY')
-
-def validate_message(mensagem):
-    """Valida se a mensagem contém todos os campos necessários"""
-    required_fields = ['email', 'assunto', 'mensagem']
-    missing_fields = [field for field in required_fields if field not in mensagem]
-    
-    if missing_fields:
-        return False, f"Campos obrigatórios ausentes: {missing_fields}"
-    
-    if not mensagem['email'] or not mensagem['assunto'] or not mensagem['mensagem']:
-        return False, "Campos obrigatórios não podem estar vazios"
-    
-    return True, "Mensagem válida"
-
-def log_with_timestamp(message):
-    """Adiciona timestamp aos logs"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{timestamp}] {message}")
+import os
+import signal
+import logging
+import threading
+from delivery import DeliveryEngine, run_consumer, WORKER_CONCURRENCY, BATCH_SIZE, BATCH_LINGER
+from queues import open_queue
+from db_pool import PostgresPool, dsn_from_env
+from status import StatusWriter, STATUS_TRACKING
+from templates import TemplateCache
+from bodies import BodyCache
+from logs import setup_logging
+from metrics import start_metrics_server, register_queue_gauges
+
+logger = logging.getLogger('worker')
+
 
 def main():
-    redis_host = os.getenv('REDIS_HOST', 'queue') 
+    setup_logging('worker')
+
+    redis_host = os.getenv('REDIS_HOST', 'queue')
     redis_port = int(os.getenv('REDIS_PORT', 6379))
     redis_password = os.getenv('REDIS_PASSWORD')
-    
-    log_with_timestamp(f"Iniciando conexão com Redis em {redis_host}:{redis_port}")
-    
+
+    logger.info("Iniciando conexão com Redis em %s:%s", redis_host, redis_port)
+
     try:
         # Configuração do Redis sem username fixo
         redis_conn = redis.Redis(
-            host=redis_host, 
-            port=redis_port, 
+            host=redis_host,
+            port=redis_port,
             password=redis_password,
             db=0
         )
         # Testa a conexão
         redis_conn.ping()
-        log_with_timestamp("✅ Conexão com Redis estabelecida com sucesso")
+        logger.info("✅ Conexão com Redis estabelecida com sucesso")
     except Exception as e:
-        log_with_timestamp(f"❌ Erro ao conectar com Redis: {e}")
+        logger.error("❌ Erro ao conectar com Redis: %s", e)
         return
-    
+
     # Email remetente configurável
     # from_email = os.getenv('FROM_EMAIL', 'onboarding@resend.dev')
     from_email = 'send-email@davi64lima.shop'
 
-    log_with_timestamp('🚀 Worker iniciado!')
-    log_with_timestamp(f'📧 Email remetente: {from_email}')
-    log_with_timestamp('⏳ Aguardando mensagens na fila "sender"...')
-
-    message_count = 0
-    error_count = 0
-
-    while True:
-        try:
-            log_with_timestamp("🔍 Verificando mensagens na fila...")
-            
-            # Espera uma nova mensagem na fila 'sender'
-            mensagem_raw = redis_conn.blpop('sender', timeout=5)[1]
-            message_count += 1
-            
-            log_with_timestamp(f"📨 Mensagem #{message_count} capturada do Redis")
-            log_with_timestamp(f"📄 Tamanho da mensagem: {len(mensagem_raw)} bytes")
-            
-            # Decodifica e valida a mensagem
-            try:
-                mensagem = json.loads(mensagem_raw)
-                log_with_timestamp(f"✅ Mensagem JSON decodificada com sucesso")
-            except json.JSONDecodeError as e:
-                log_with_timestamp(f"❌ Erro ao decodificar JSON: {e}")
-                error_count += 1
-                continue
-            
-            # Valida os campos da mensagem
-            is_valid, validation_msg = validate_message(mensagem)
-            if not is_valid:
-                log_with_timestamp(f"❌ Validação falhou: {validation_msg}")
-                log_with_timestamp(f"📋 Conteúdo da mensagem: {mensagem}")
-                error_count += 1
-                continue
-            
-            log_with_timestamp(f"✅ Mensagem validada: {validation_msg}")
-            log_with_timestamp(f"📧 Enviando email para: {mensagem['email']}")
-            log_with_timestamp(f"📝 Assunto: {mensagem['assunto']}")
-            log_with_timestamp(f"📄 Tamanho do conteúdo: {len(mensagem['mensagem'])} caracteres")
-
-            # Envia o e-mail
-            email_response = resend.Emails.send({
-                "from": from_email,
-                "to": mensagem['email'],
-                "subject": mensagem['assunto'],
-                "html": mensagem['mensagem']
-            })
-
-            log_with_timestamp(f"✅ Email enviado com sucesso!")
-            log_with_timestamp(f"📊 Resposta do Resend: {email_response}")
-            log_with_timestamp(f"📈 Estatísticas - Mensagens processadas: {message_count}, Erros: {error_count}")
-
-        except redis.exceptions.TimeoutError:
-            log_with_timestamp("⏰ Timeout - Nenhuma mensagem na fila nos últimos 5 segundos")
-            continue
-        except Exception as e:
-            error_count += 1
-            log_with_timestamp(f"❌ Erro ao processar mensagem: {e}")
-            log_with_timestamp(f"📈 Estatísticas - Mensagens processadas: {message_count}, Erros: {error_count}")
-            sleep(2)  # Espera antes de tentar novamente
+    logger.info('🚀 Worker iniciado!')
+    logger.info('📧 Email remetente: %s', from_email)
+    logger.info('🧵 Envios simultâneos: %s', WORKER_CONCURRENCY)
+    logger.info('📦 Lotes de até %s emails (espera máx. %ss)', BATCH_SIZE, BATCH_LINGER)
+    logger.info('⏳ Aguardando mensagens nas filas "sender" (alta, normal, baixa)...')
+
+    # Um pool só para o status, os templates e os corpos, usado pelas
+    # WORKER_CONCURRENCY threads de envio ao mesmo tempo (+1 para o StatusWriter)
+    pool = PostgresPool(dsn_from_env(), minconn=0,
+                        maxconn=int(os.getenv('WORKER_DB_POOL_MAX', WORKER_CONCURRENCY + 1)))
+
+    # Resultado de cada envio gravado na tabela emails (STATUS_TRACKING=false desliga)
+    status = StatusWriter(pool) if STATUS_TRACKING else None
+    if status:
+        status.start()
+        logger.info('🗂️ Status dos envios gravado no banco')
+
+    queue = open_queue(redis_conn)
+    engine = DeliveryEngine(queue, from_email, status=status, templates=TemplateCache(pool),
+                            bodies=BodyCache(pool))
+    stopping = threading.Event()
+    logger.info('🪪 Consumidor: %s', queue.consumer)
+    logger.info('📮 Transporte: %s', engine.transport.name)
+
+    register_queue_gauges(redis_conn, queue.transport)
+    metrics_server = start_metrics_server()
+    if metrics_server:
+        logger.info('📈 Métricas em http://0.0.0.0:%s/metrics', metrics_server.server_port)
+
+    def shutdown(signum, _frame):
+        logger.info("🛑 Sinal %s recebido, finalizando envios pendentes...", signum)
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    run_consumer(queue, engine, lambda: not stopping.is_set())
+    if status:
+        status.stop()
+    pool.closeall()
+    logger.info("👋 Worker finalizado. %s", engine.stats)
+    logger.info("🔌 Conexões com o provedor: %s", engine.transport.stats())
 
 if __name__ == '__main__':
     main()